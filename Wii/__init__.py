@@ -1,5 +1,11 @@
 #!/usr/bin/env python3
+import sys
+
 from .common import *
 from .archive import *
 from .export import *
 from .formats import *
+from .storage import *
+
+if sys.version_info >= (3, 5):  # async/await syntax
+    from .wc24 import *
@@ -1,13 +1,36 @@
 #!/usr/bin/env python3
+import array
 import hashlib
+import os
+import struct
+import sys
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from ctypes import *
+from itertools import islice
 
-from Crypto.Cipher import AES
+try:
+    from Crypto.Cipher import AES
+    from Crypto.Hash import MD5, SHA1
+except ImportError:  # pycryptodome is optional if another backend is available
+    AES = None
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:  # cryptography is optional
+    Cipher = None
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional
+    numpy = None
 
 # Constants
 SDKEY = b"\xAB\x01\xB9\xD8\xE1\x62\x2B\x08\xAF\xBA\xD8\x4D\xBF\xC2\xA5\x5D"
 SDIV = b"\x21\x67\x12\xE6\xAA\x1F\x68\x9F\x95\xC5\xA2\x23\x24\xDC\x6A\x98"
 MD5BLANKER = b"\x0E\x65\x37\x81\x99\xBE\x45\x17\xAB\x06\xEC\x22\x45\x1A\x57\x93"
+CHUNKSIZE = 0x10000
 
 
 def align_value(value, blocksize=64):
@@ -52,6 +75,102 @@ def pad_to_cbyte_array(value, size):
     return value
 
 
+def find_free_slots(occupancy, slots, count=1, strategy="first"):
+    """Finds count consecutive free slots in an occupancy bitmap in one pass.
+
+    Args:
+        occupancy (int): Bitmap, bit n is set if slot n is used
+        slots (int): Number of slots
+        count (int): Number of consecutive free slots needed
+        strategy (str): "first" for the first run of free slots that fits (first-fit), "best" for the smallest
+                        one (best-fit, keeps large gaps for groups)
+
+    Returns:
+        int: First slot of the run
+    """
+    if strategy not in ["first", "best"]:
+        raise ValueError("Strategy must be 'first' or 'best'.")
+    if count < 1:
+        raise ValueError("Count must be at least 1.")
+
+    best = None
+    start = None
+    for slot in range(slots + 1):
+        if slot < slots and not (occupancy >> slot) & 1:
+            if start is None:
+                start = slot
+            continue
+        if start is not None and slot - start >= count:
+            if strategy == "first":
+                return start
+            if best is None or slot - start < best[1]:
+                best = (start, slot - start)
+        start = None
+
+    if best is None:
+        raise LookupError("Not enough free slots ({0} needed).".format(count))
+    return best[0]
+
+
+def count_used_slots(table, stride, offset, empty):
+    """Helper function: Counts the used slots of a raw slot table. A slot is used if its discriminator (the
+       len(empty) bytes at offset in every slot) isn't empty. All discriminators are read from one memoryview,
+       without creating a ctypes object per slot.
+
+    Args:
+        table (bytes-like): Raw slot table
+        stride (int): Size of a slot
+        offset (int): Offset of the discriminator in a slot
+        empty (bytes): Value of the discriminator of empty slots
+
+    Returns:
+        int: Number of used slots
+    """
+    view = memoryview(table).cast("B")
+    slots = len(view) // stride
+    if len(empty) == 1:
+        return slots - view[offset::stride].tobytes()[:slots].count(empty)
+    if numpy is not None:
+        discriminators = numpy.frombuffer(view, dtype=numpy.uint8)[:slots * stride].reshape(slots, stride)
+        discriminators = discriminators[:, offset:offset + len(empty)]
+        return int((discriminators != numpy.frombuffer(empty, dtype=numpy.uint8)).any(axis=1).sum())
+    return sum(1 for start in range(offset, slots * stride, stride) if view[start:start + len(empty)] != empty)
+
+
+def process_chunks(worker, args, rows, workers=None, chunksize=256):
+    """Calls worker(*args, start, chunk) for chunks of rows in a process pool and yields the items of the returned
+       lists in the order of the rows. Rows are read lazily, so they can be an endless stream, and at most
+       2 * workers chunks are pending at once. worker and args have to be picklable.
+
+    Args:
+        worker (callable): Function that processes a chunk, gets the index of its first row as `start`
+        args (tuple): Arguments passed to worker before start and the chunk
+        rows (iterable): Rows to process
+        workers (int[optional]): Number of processes. Defaults to the number of CPUs, 1 disables the pool
+        chunksize (int): Number of rows per chunk
+    """
+    rows = iter(rows)
+    chunks = iter(lambda: list(islice(rows, chunksize)), [])
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        for i, chunk in enumerate(chunks):
+            for item in worker(*args + (i * chunksize, chunk)):
+                yield item
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for i, chunk in enumerate(chunks):
+            pending.append(pool.submit(worker, *args + (i * chunksize, chunk)))
+            if len(pending) >= 2 * workers:  # Don't read more rows than the pool can work on
+                for item in pending.popleft().result():
+                    yield item
+        while pending:
+            for item in pending.popleft().result():
+                yield item
+
+
 class BigEndianStructure(BigEndianStructure):
     """Extends BigEndianStructure class to optionally load bytes from file.
 
@@ -82,57 +201,558 @@ class BigEndianStructure(BigEndianStructure):
             return file.name
 
 
+class Batch:
+    """Queues changes to a Struct and applies them at once when the with block is left without an exception.
+       If one of them fails, the Struct is restored to its previous state and the exception is raised.
+       The MD5 is updated exactly once after all changes were applied.
+
+       Usage:
+           with locdat.batch() as batch:
+               batch.add_channel_by_id4("HAXX", 0, 0, 1)
+               batch.move_channel(0, 0, 0, 1, 0, 0)
+
+       Args:
+           struct (BigEndianStructure): Struct with a BATCH_OPERATIONS list and update_md5()
+    """
+
+    def __init__(self, struct):
+        self.struct = struct
+        self.operations = []
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name not in self.struct.BATCH_OPERATIONS:
+            raise AttributeError("{0} can't be batched.".format(name))
+        method = getattr(self.struct, name)
+
+        def queue(*args, **kwargs):
+            self.operations.append((method, args, kwargs))
+        return queue
+
+    def commit(self):
+        """Applies all queued changes and updates the MD5."""
+        snapshot = bytes(self.struct)
+        md5_outdated = self.struct.md5_outdated
+        try:
+            for method, args, kwargs in self.operations:
+                method(*args, **kwargs)
+        except Exception:
+            memoryview(self.struct).cast("B")[:] = snapshot
+            self.struct.md5_outdated = md5_outdated
+            self.struct._clear_caches()
+            raise
+        finally:
+            self.operations = []
+        self.struct.update_md5()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.operations = []
+        return False
+
+
 class Crypto:
     """Cryptographic/Hash helper class."""
     ALIGN = 64
+    _WORDTYPE = "I" if array.array("I").itemsize == 4 else "L"
+
+    BACKENDS = {}  # Filled below: name -> backend class
+    PRIMITIVES = ["aes", "md5", "sha1"]
+    _selected = {}
+
+    class Backend:
+        """Base class for crypto backends. A backend provides some of the primitives in Crypto.PRIMITIVES:
+           new_cbc(key, iv) returns an AES-CBC context with encrypt(data, output=None) and
+           decrypt(data, output=None), md5(data)/sha1(data) return hash objects with update() and digest().
+           Unsupported primitives are None.
+        """
+        NAME = None
+        NATIVE = True  # Pure-Python implementations are only used if nothing else is available
+        new_cbc = None
+        md5 = None
+        sha1 = None
+
+        @classmethod
+        def is_available(cls):
+            """Returns True if the backend can be used on this host."""
+            return True
+
+        @classmethod
+        def supports(cls, primitive):
+            """Returns True if the backend provides primitive."""
+            return cls.is_available() and (cls.new_cbc if primitive == "aes" else getattr(cls, primitive)) is not None
+
+    class PyCryptodome(Backend):
+        """pycryptodome (AES-NI accelerated where available)."""
+        NAME = "pycryptodome"
+
+        @classmethod
+        def is_available(cls):
+            return AES is not None
+
+        @staticmethod
+        def new_cbc(key, iv):
+            return AES.new(key, AES.MODE_CBC, iv)
+
+        @staticmethod
+        def md5(data=b""):
+            return MD5.new(data)
+
+        @staticmethod
+        def sha1(data=b""):
+            return SHA1.new(data)
+
+    class Cryptography(Backend):
+        """cryptography (OpenSSL)."""
+        NAME = "cryptography"
+
+        class Context:
+            """Adapts a cryptography CBC cipher to the interface of pycryptodome's."""
+
+            def __init__(self, key, iv):
+                self.cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
+                self.context = None
+
+            def _update(self, func, data, output):
+                """Helper function: Runs data through the encryptor or decryptor."""
+                if self.context is None:
+                    self.context = getattr(self.cipher, func)()
+                result = self.context.update(data)
+                if output is None:
+                    return result
+                output[:len(result)] = result
+
+            def encrypt(self, data, output=None):
+                return self._update("encryptor", data, output)
+
+            def decrypt(self, data, output=None):
+                return self._update("decryptor", data, output)
+
+        @classmethod
+        def is_available(cls):
+            return Cipher is not None
+
+        @classmethod
+        def new_cbc(cls, key, iv):
+            return cls.Context(key, iv)
+
+    class PurePython(Backend):
+        """Pure-Python AES (table-based), slow but always available."""
+        NAME = "python"
+        NATIVE = False
+        _tables = None
+
+        class Context:
+            """AES-CBC on 32-bit words, using the combined SubBytes/ShiftRows/MixColumns tables."""
+
+            def __init__(self, key, iv):
+                self.tables = Crypto.PurePython.get_tables()
+                self.key = key
+                self.keys = None
+                self.iv = list(struct.unpack(">4I", iv))
+
+            def _expand_key(self, decrypt):
+                """Helper function: Returns the round keys (for the equivalent inverse cipher if decrypt is set)."""
+                sbox, inv_sbox, te, td = self.tables
+                nk = len(self.key) // 4
+                rounds = nk + 6
+                words = list(struct.unpack(">{0}I".format(nk), self.key))
+                rcon = 1
+                for i in range(nk, 4 * (rounds + 1)):
+                    temp = words[i - 1]
+                    if i % nk == 0:
+                        temp = ((sbox[(temp >> 16) & 0xFF] << 24) | (sbox[(temp >> 8) & 0xFF] << 16) |
+                                (sbox[temp & 0xFF] << 8) | sbox[temp >> 24]) ^ (rcon << 24)
+                        rcon = (rcon << 1) ^ (0x11B if rcon & 0x80 else 0)
+                    elif nk > 6 and i % nk == 4:
+                        temp = ((sbox[temp >> 24] << 24) | (sbox[(temp >> 16) & 0xFF] << 16) |
+                                (sbox[(temp >> 8) & 0xFF] << 8) | sbox[temp & 0xFF])
+                    words.append(words[i - nk] ^ temp)
+                keys = [words[4 * r:4 * r + 4] for r in range(rounds + 1)]
+                if decrypt:
+                    keys.reverse()
+                    for r in range(1, rounds):
+                        keys[r] = [td[0][sbox[w >> 24]] ^ td[1][sbox[(w >> 16) & 0xFF]] ^
+                                   td[2][sbox[(w >> 8) & 0xFF]] ^ td[3][sbox[w & 0xFF]] for w in keys[r]]
+                return keys
+
+            def _crypt(self, data, output, decrypt):
+                """Helper function: Runs CBC over data."""
+                if len(data) % 16:
+                    raise ValueError("Data must be padded to 16 byte boundary in CBC mode")
+                if self.keys is None:
+                    self.keys = self._expand_key(decrypt)
+                    self.decrypting = decrypt
+                elif self.decrypting != decrypt:
+                    raise TypeError("A context can either encrypt or decrypt, not both.")
+                result = output if output is not None else bytearray(len(data))
+                sbox, inv_sbox, te, td = self.tables
+                box, (t0, t1, t2, t3) = (inv_sbox, td) if decrypt else (sbox, te)
+                keys = self.keys
+                first, last = keys[0], keys[-1]
+                c0, c1, c2, c3 = self.iv
+                for offset in range(0, len(data), 16):
+                    w0, w1, w2, w3 = struct.unpack_from(">4I", data, offset)
+                    if decrypt:
+                        s0, s1, s2, s3 = w0 ^ first[0], w1 ^ first[1], w2 ^ first[2], w3 ^ first[3]
+                    else:
+                        s0, s1, s2, s3 = (w0 ^ c0 ^ first[0], w1 ^ c1 ^ first[1],
+                                          w2 ^ c2 ^ first[2], w3 ^ c3 ^ first[3])
+                    for k in keys[1:-1]:
+                        if decrypt:  # InvShiftRows takes the bytes from the other direction
+                            s0, s1, s2, s3 = (
+                                t0[s0 >> 24] ^ t1[(s3 >> 16) & 0xFF] ^ t2[(s2 >> 8) & 0xFF] ^ t3[s1 & 0xFF] ^ k[0],
+                                t0[s1 >> 24] ^ t1[(s0 >> 16) & 0xFF] ^ t2[(s3 >> 8) & 0xFF] ^ t3[s2 & 0xFF] ^ k[1],
+                                t0[s2 >> 24] ^ t1[(s1 >> 16) & 0xFF] ^ t2[(s0 >> 8) & 0xFF] ^ t3[s3 & 0xFF] ^ k[2],
+                                t0[s3 >> 24] ^ t1[(s2 >> 16) & 0xFF] ^ t2[(s1 >> 8) & 0xFF] ^ t3[s0 & 0xFF] ^ k[3]
+                            )
+                        else:
+                            s0, s1, s2, s3 = (
+                                t0[s0 >> 24] ^ t1[(s1 >> 16) & 0xFF] ^ t2[(s2 >> 8) & 0xFF] ^ t3[s3 & 0xFF] ^ k[0],
+                                t0[s1 >> 24] ^ t1[(s2 >> 16) & 0xFF] ^ t2[(s3 >> 8) & 0xFF] ^ t3[s0 & 0xFF] ^ k[1],
+                                t0[s2 >> 24] ^ t1[(s3 >> 16) & 0xFF] ^ t2[(s0 >> 8) & 0xFF] ^ t3[s1 & 0xFF] ^ k[2],
+                                t0[s3 >> 24] ^ t1[(s0 >> 16) & 0xFF] ^ t2[(s1 >> 8) & 0xFF] ^ t3[s2 & 0xFF] ^ k[3]
+                            )
+                    state = [s0, s1, s2, s3]
+                    out = []
+                    for i in range(4):
+                        if decrypt:
+                            a, b, c, d = state[i], state[(i + 3) % 4], state[(i + 2) % 4], state[(i + 1) % 4]
+                        else:
+                            a, b, c, d = state[i], state[(i + 1) % 4], state[(i + 2) % 4], state[(i + 3) % 4]
+                        out.append(((box[a >> 24] << 24) | (box[(b >> 16) & 0xFF] << 16) |
+                                    (box[(c >> 8) & 0xFF] << 8) | box[d & 0xFF]) ^ last[i])
+                    if decrypt:
+                        struct.pack_into(">4I", result, offset, out[0] ^ c0, out[1] ^ c1, out[2] ^ c2, out[3] ^ c3)
+                        c0, c1, c2, c3 = w0, w1, w2, w3
+                    else:
+                        struct.pack_into(">4I", result, offset, *out)
+                        c0, c1, c2, c3 = out
+                self.iv = [c0, c1, c2, c3]
+                if output is None:
+                    return bytes(result)
+
+            def encrypt(self, data, output=None):
+                return self._crypt(data, output, False)
+
+            def decrypt(self, data, output=None):
+                return self._crypt(data, output, True)
+
+        @classmethod
+        def get_tables(cls):
+            """Returns the S-box, the inverse S-box and the encryption/decryption tables (generated once)."""
+            if cls._tables is None:
+                def mul(a, b):
+                    result = 0
+                    while b:
+                        if b & 1:
+                            result ^= a
+                        a = (a << 1) ^ (0x11B if a & 0x80 else 0)
+                        b >>= 1
+                    return result
+
+                sbox = [0] * 256
+                inv_sbox = [0] * 256
+                for x in range(256):
+                    inverse = next((y for y in range(1, 256) if mul(x, y) == 1), 0)
+                    s = inverse
+                    for shift in range(1, 5):
+                        s ^= ((inverse << shift) | (inverse >> (8 - shift))) & 0xFF
+                    sbox[x] = s ^ 0x63
+                    inv_sbox[sbox[x]] = x
+
+                te = [[0] * 256 for i in range(4)]
+                td = [[0] * 256 for i in range(4)]
+                for x in range(256):
+                    s, i = sbox[x], inv_sbox[x]
+                    e = (mul(s, 2) << 24) | (s << 16) | (s << 8) | mul(s, 3)
+                    d = (mul(i, 14) << 24) | (mul(i, 9) << 16) | (mul(i, 13) << 8) | mul(i, 11)
+                    for r in range(4):
+                        te[r][x] = ((e >> (8 * r)) | (e << (32 - 8 * r))) & 0xFFFFFFFF
+                        td[r][x] = ((d >> (8 * r)) | (d << (32 - 8 * r))) & 0xFFFFFFFF
+                cls._tables = (sbox, inv_sbox, te, td)
+            return cls._tables
+
+        @classmethod
+        def new_cbc(cls, key, iv):
+            return cls.Context(key, iv)
+
+    class Hashlib(Backend):
+        """hashlib module of the standard library (OpenSSL)."""
+        NAME = "hashlib"
+        md5 = staticmethod(hashlib.md5)
+        sha1 = staticmethod(hashlib.sha1)
+
+    for backend in [PyCryptodome, Cryptography, PurePython, Hashlib]:
+        BACKENDS[backend.NAME] = backend
+    del backend
 
     @classmethod
-    def decrypt_data(cls, key, iv, data, align=True):
+    def _benchmark(cls, backend, primitive, size=0x10000):
+        """Helper function: Returns the seconds backend needs to process size bytes with primitive."""
+        data = bytes(size)
+        start = time.perf_counter()
+        if primitive == "aes":
+            backend.new_cbc(SDKEY, SDIV).encrypt(data)
+        else:
+            getattr(backend, primitive)(data).digest()
+        return time.perf_counter() - start
+
+    @classmethod
+    def select_backend(cls, primitive):
+        """Probes all backends providing primitive and returns the fastest one. Pure-Python backends are only
+           considered if no native one is available.
+        """
+        backends = [backend for backend in cls.BACKENDS.values() if backend.supports(primitive)]
+        if not backends:
+            raise Exception("No crypto backend available for {0}.".format(primitive))
+        backends = [backend for backend in backends if backend.NATIVE] or backends
+        if len(backends) == 1:
+            return backends[0]
+        return min(backends, key=lambda backend: min(cls._benchmark(backend, primitive) for i in range(3)))
+
+    @classmethod
+    def get_backend(cls, primitive="aes"):
+        """Returns the backend used for primitive ("aes", "md5" or "sha1"). It's selected on first use."""
+        if primitive not in cls._selected:
+            cls._selected[primitive] = cls.select_backend(primitive)
+        return cls._selected[primitive]
+
+    @classmethod
+    def set_backend(cls, name, primitives=None):
+        """Forces a backend for primitives (defaults to all primitives it provides).
+
+        Args:
+            name (str): Name of the backend (see Crypto.BACKENDS)
+            primitives (list[optional]): Primitives to use the backend for
+        """
+        if name not in cls.BACKENDS:
+            raise ValueError("Unknown backend {0}.".format(name))
+        backend = cls.BACKENDS[name]
+        if not backend.is_available():
+            raise Exception("Backend {0} is not available.".format(name))
+        if primitives is None:
+            primitives = [primitive for primitive in cls.PRIMITIVES if backend.supports(primitive)]
+        for primitive in primitives:
+            if not backend.supports(primitive):
+                raise ValueError("Backend {0} doesn't support {1}.".format(name, primitive))
+            cls._selected[primitive] = backend
+
+    @classmethod
+    def new_hash(cls, algorithm, data=b""):
+        """Returns a hash object ("md5" or "sha1") of the selected backend, which supports update() and digest()."""
+        return getattr(cls.get_backend(algorithm), algorithm)(data)
+
+    class CBC:
+        """AES-CBC context that carries the IV across chunks, so data can be processed piece by piece without
+           creating a new cipher for every chunk. Results can be written into caller-supplied buffers (`output`),
+           which may also be the input buffer itself to work in-place.
+           A context can either encrypt or decrypt, not both.
+
+        Args:
+            key (bytes): Key
+            iv (bytes): Initialization vector
+        """
+        BLOCKSIZE = 16
+
+        def __init__(self, key, iv):
+            self.cipher = Crypto.get_backend("aes").new_cbc(key, iv)
+
+        def _process(self, func, data, output, align):
+            """Helper function: Runs func over data. Only the last partial block is copied for padding."""
+            view = memoryview(data).cast("B")
+            length = len(view)
+            size = align_value(length, align) if align else length
+            head = length - (length % self.BLOCKSIZE)
+            if size % self.BLOCKSIZE:
+                raise ValueError("Data must be padded to {0} byte boundary in CBC mode.".format(self.BLOCKSIZE))
+
+            if output is None:
+                if size == length:
+                    return func(view)
+                result = bytearray(size)
+                self._process(func, view, result, align)
+                return bytes(result)
+
+            out = memoryview(output).cast("B")
+            if len(out) < size:
+                raise ValueError("Output buffer is too small ({0} < {1} bytes).".format(len(out), size))
+            if head:
+                func(view[:head], output=out[:head])
+            if size > head:
+                tail = bytearray(size - head)
+                tail[:length - head] = view[head:]
+                func(tail, output=out[head:size])
+            return output
+
+        def decrypt(self, data, output=None, align=0):
+            """Decrypts the next chunk.
+
+            Args:
+                data (bytes-like): Data to decrypt (must be a multiple of 16 bytes, unless align is set)
+                output (bytearray or memoryview[optional]): Buffer to write the decrypted data to
+                align (int): Pad data with zeros to a multiple of align bytes. Defaults to 0 (no padding)
+
+            Returns:
+                bytes: Decrypted data (or output, if given)
+            """
+            return self._process(self.cipher.decrypt, data, output, align)
+
+        def encrypt(self, data, output=None, align=0):
+            """Encrypts the next chunk.
+
+            Args:
+                data (bytes-like): Data to encrypt (must be a multiple of 16 bytes, unless align is set)
+                output (bytearray or memoryview[optional]): Buffer to write the encrypted data to
+                align (int): Pad data with zeros to a multiple of align bytes. Defaults to 0 (no padding)
+
+            Returns:
+                bytes: Encrypted data (or output, if given)
+            """
+            return self._process(self.cipher.encrypt, data, output, align)
+
+    @classmethod
+    def decrypt_data(cls, key, iv, data, align=True, output=None):
         """Decrypts data (aligns to 64 bytes if needed).
 
         Args:
             key (bytes): Decryption key
             iv (bytes): Initialization vector
-            data (bytes): Data to decrypt
+            data (bytes-like): Data to decrypt
             align (bool): Align to 64 bytes. Defaults to True
+            output (bytearray or memoryview[optional]): Buffer to decrypt into (can be data itself)
 
         Returns:
-            bytes: Decrypted data
+            bytes: Decrypted data (or output, if given)
         """
-        if (len(data) % cls.ALIGN) != 0 and align:
-            return AES.new(key, AES.MODE_CBC, iv).decrypt(data + (b"\x00" * (cls.ALIGN - (len(data) % cls.ALIGN))))
-        else:
-            return AES.new(key, AES.MODE_CBC, iv).decrypt(data)
+        return cls.CBC(key, iv).decrypt(data, output, cls.ALIGN if align else 0)
 
     @classmethod
-    def encrypt_data(cls, key, iv, data, align=True):
+    def encrypt_data(cls, key, iv, data, align=True, output=None):
         """Encrypts data (aligns to 64 bytes, if needed).
 
         Args:
             key (bytes): Encryption key
             iv (bytes): Initialization vector
-            data (bytes): Data to encrypt
+            data (bytes-like): Data to encrypt
             align (bool): Align to 64 bytes. Defaults to True
+            output (bytearray or memoryview[optional]): Buffer to encrypt into (can be data itself)
 
         Returns:
-            bytes: Encrypted data
+            bytes: Encrypted data (or output, if given)
         """
-        if (len(data) % cls.ALIGN) != 0 and align:
-            return AES.new(key, AES.MODE_CBC, iv).encrypt(data + (b"\x00" * (cls.ALIGN - (len(data) % cls.ALIGN))))
-        else:
-            return AES.new(key, AES.MODE_CBC, iv).encrypt(data)
+        return cls.CBC(key, iv).encrypt(data, output, cls.ALIGN if align else 0)
+
+    @classmethod
+    def decrypt_stream(cls, key, iv, src, dst, size, length=None, chunksize=CHUNKSIZE):
+        """Decrypts size bytes from a file object to another one in chunks, so the data is never fully in memory.
+           A single buffer is reused for all chunks.
+
+        Args:
+            key (bytes): Decryption key
+            iv (bytes): Initialization vector
+            src (file): File object to read the encrypted data from
+            dst (file): File object to write the decrypted data to
+            size (int): Number of bytes to decrypt (must be a multiple of 16)
+            length (int[optional]): Number of decrypted bytes to write. Defaults to size
+            chunksize (int): Number of bytes to decrypt at once
+
+        Returns:
+            int: Number of bytes written
+        """
+        if length is None:
+            length = size
+        cipher = cls.CBC(key, iv)
+        buffer = memoryview(bytearray(min(chunksize, size)))
+        written = 0
+        while size > 0:
+            read = src.readinto(buffer[:min(chunksize, size)])
+            if not read:
+                raise Exception("Unexpected end of file.")
+            size -= read
+            chunk = cipher.decrypt(buffer[:read], output=buffer[:read])
+            if written + len(chunk) > length:
+                chunk = chunk[:length - written]
+            dst.write(chunk)
+            written += len(chunk)
+        return written
 
     @classmethod
-    def create_md5hash(cls, data):
+    def encrypt_stream(cls, key, iv, src, dst, size, chunksize=CHUNKSIZE):
+        """Encrypts size bytes from a file object to another one in chunks, so the data is never fully in memory.
+           The last chunk is aligned to 64 bytes. A single buffer is reused for all chunks.
+
+        Args:
+            key (bytes): Encryption key
+            iv (bytes): Initialization vector
+            src (file or bytes-like): File object or buffer (e.g. a memoryview) to read the data from
+            dst (file): File object to write the encrypted data to
+            size (int): Number of bytes to encrypt
+            chunksize (int): Number of bytes to encrypt at once (must be a multiple of 64)
+
+        Returns:
+            int: Number of bytes written
+        """
+        cipher = cls.CBC(key, iv)
+        view = None if hasattr(src, "read") else memoryview(src).cast("B")
+        buffer = memoryview(bytearray(align_value(min(chunksize, size), cls.ALIGN)))
+        position = 0
+        written = 0
+        while size > 0:
+            if view is None:
+                read = src.readinto(buffer[:min(chunksize, size)])
+                chunk = buffer[:read]
+            else:
+                chunk = view[position:position + min(chunksize, size)]
+                read = len(chunk)
+                position += read
+            if not read:
+                raise Exception("Unexpected end of file.")
+            size -= read
+            out = buffer[:align_value(read, cls.ALIGN)]
+            cipher.encrypt(chunk, output=out, align=cls.ALIGN)
+            dst.write(out)
+            written += len(out)
+        return written
+
+    @classmethod
+    def create_md5hash(cls, data, blank_offset=None):
         """MD5 hashes a byte-string.
 
         Args:
-            data (bytes): Data to hash
+            data (bytes-like): Data to hash (e.g. a Struct)
+            blank_offset (int[optional]): Offset of an MD5 field in data which is hashed as MD5BLANKER instead,
+                                          without copying data
 
         Returns:
             bytes: MD5 hash
         """
-        return hashlib.md5(data).digest()
+        if blank_offset is None:
+            return cls.new_hash("md5", data).digest()
+        view = memoryview(data).cast("B")
+        md5hash = cls.new_hash("md5", view[:blank_offset])
+        md5hash.update(MD5BLANKER)
+        md5hash.update(view[blank_offset + len(MD5BLANKER):])
+        return md5hash.digest()
+
+    @classmethod
+    def update_checksum(cls, checksum, old, new):
+        """Updates a checksum from generate_checksum() after a part of the data changed from old to new, without
+           summing the rest of the data again. The changed part must start at a multiple of 4 in the data.
+
+        Args:
+            checksum (int): Checksum of the data before the change
+            old (bytes): Old value of the changed part
+            new (bytes): New value of the changed part
+
+        Returns:
+            int: The updated checksum
+        """
+        return (checksum - cls.generate_checksum(old) + cls.generate_checksum(new)) & 0xFFFFFFFF
 
     @classmethod
     def generate_checksum(cls, data):
@@ -145,15 +765,448 @@ class Crypto:
           3) Grab the lower 32 bits
         Reference: https://git.io/fj3iW
 
+        If the length isn't a multiple of 4, the remaining 1-3 bytes are added as a (shorter) big endian integer.
+        The words are summed with NumPy if it's available, otherwise with the array module.
+
         Args:
-            data (bytes): Data to generate checksum for
+            data (bytes-like): Data to generate checksum for
 
         Returns:
             int: The generated checksum
         """
-        checksum = 0
-        for block in range(0, len(data), 4):
-            b = data[block:block + 4]
-            checksum += int.from_bytes(b, byteorder="big")
+        view = memoryview(data).cast("B")
+        end = len(view) - (len(view) % 4)
+        if numpy is not None:
+            # uint64 wraps around at 2^64, which doesn't change the lower 32 bits
+            checksum = int(numpy.frombuffer(view[:end], dtype=">u4").sum(dtype=numpy.uint64))
+        else:
+            words = array.array(cls._WORDTYPE)
+            words.frombytes(view[:end])
+            if sys.byteorder == "little":
+                words.byteswap()
+            checksum = sum(words)
+        checksum += int.from_bytes(view[end:], byteorder="big")
         checksum &= 0xFFFFFFFF
         return checksum
+
+    @classmethod
+    def generate_checksums(cls, buffers, end=None):
+        """Generates the checksums of many buffers at once (see generate_checksum()).
+        Buffers of the same length are summed in one go with NumPy if it's available.
+
+        Args:
+            buffers (list): Buffers (bytes-like) to generate checksums for
+            end (int[optional]): Only use the data up to this offset of every buffer, e.g. -4 to skip a trailing
+                                 checksum. Defaults to the whole buffer
+
+        Returns:
+            list: The generated checksums in the same order
+        """
+        views = [memoryview(buffer).cast("B")[:end] for buffer in buffers]
+        if numpy is None or not views or len(set(len(view) for view in views)) != 1 or len(views[0]) % 4:
+            return [cls.generate_checksum(view) for view in views]
+
+        words = numpy.frombuffer(b"".join(views), dtype=">u4").reshape(len(views), -1)
+        return [int(checksum) & 0xFFFFFFFF for checksum in words.sum(axis=1, dtype=numpy.uint64)]
+
+
+class RGB5A3:
+    """Converts RGB5A3 images (used for savegame banners and icons) from and to RGBA8.
+       Pixels are stored as big endian 16 bit values in 4x4 tiles. If the top bit is set, the pixel is RGB555,
+       otherwise RGB4A3. Uses NumPy if it's available.
+       Reference: http://wiibrew.org/wiki/TPL
+    """
+    TILESIZE = 4
+    _table = None
+    _orders = {}
+
+    @staticmethod
+    def _to_rgba(value):
+        """Helper function: Converts a single RGB5A3 value to a RGBA8 tuple."""
+        if value & 0x8000:  # RGB555
+            r, g, b = (value >> 10) & 0x1F, (value >> 5) & 0x1F, value & 0x1F
+            return (r << 3) | (r >> 2), (g << 3) | (g >> 2), (b << 3) | (b >> 2), 0xFF
+        else:  # RGB4A3
+            a, r, g, b = (value >> 12) & 0x7, (value >> 8) & 0xF, (value >> 4) & 0xF, value & 0xF
+            return r * 0x11, g * 0x11, b * 0x11, (a << 5) | (a << 2) | (a >> 1)
+
+    @staticmethod
+    def _from_rgba(r, g, b, a):
+        """Helper function: Converts a RGBA8 pixel to a RGB5A3 value. Alpha >= 0xE0 is stored as opaque RGB555."""
+        if a >= 0xE0:
+            return 0x8000 | ((r >> 3) << 10) | ((g >> 3) << 5) | (b >> 3)
+        else:
+            return ((a >> 5) << 12) | ((r >> 4) << 8) | ((g >> 4) << 4) | (b >> 4)
+
+    @classmethod
+    def _get_order(cls, width, height):
+        """Helper function: Returns the linear pixel index for every pixel in tile order."""
+        if (width, height) not in cls._orders:
+            order = []
+            for tiley in range(0, height, cls.TILESIZE):
+                for tilex in range(0, width, cls.TILESIZE):
+                    for y in range(tiley, tiley + cls.TILESIZE):
+                        start = y * width + tilex
+                        order.extend(range(start, start + cls.TILESIZE))
+            cls._orders[(width, height)] = order
+        return cls._orders[(width, height)]
+
+    @classmethod
+    def _check_size(cls, width, height):
+        """Helper function: Checks that the image consists of whole tiles."""
+        if width % cls.TILESIZE or height % cls.TILESIZE:
+            raise ValueError("Width and height must be multiples of {0}.".format(cls.TILESIZE))
+
+    @classmethod
+    def decode(cls, data, width, height):
+        """Decodes RGB5A3 data.
+
+        Args:
+            data (bytes): RGB5A3 image data
+            width (int): Image width
+            height (int): Image height
+
+        Returns:
+            bytes: RGBA8 pixels, row by row
+        """
+        cls._check_size(width, height)
+        if len(data) != width * height * 2:
+            raise ValueError("Data must be {0} bytes long.".format(width * height * 2))
+
+        if numpy is not None:
+            value = numpy.frombuffer(bytes(data), dtype=">u2").astype(numpy.uint16)
+            opaque = (value & 0x8000) != 0
+            r5, g5, b5 = (value >> 10) & 0x1F, (value >> 5) & 0x1F, value & 0x1F
+            a3, r4, g4, b4 = (value >> 12) & 0x7, (value >> 8) & 0xF, (value >> 4) & 0xF, value & 0xF
+            rgba = numpy.empty((len(value), 4), dtype=numpy.uint8)
+            rgba[:, 0] = numpy.where(opaque, (r5 << 3) | (r5 >> 2), r4 * 0x11)
+            rgba[:, 1] = numpy.where(opaque, (g5 << 3) | (g5 >> 2), g4 * 0x11)
+            rgba[:, 2] = numpy.where(opaque, (b5 << 3) | (b5 >> 2), b4 * 0x11)
+            rgba[:, 3] = numpy.where(opaque, 0xFF, (a3 << 5) | (a3 << 2) | (a3 >> 1))
+            # (tile row, tile column, y, x, channel) -> (tile row, y, tile column, x, channel)
+            rgba = rgba.reshape(height // cls.TILESIZE, width // cls.TILESIZE, cls.TILESIZE, cls.TILESIZE, 4)
+            return rgba.transpose(0, 2, 1, 3, 4).tobytes()
+
+        if cls._table is None:
+            cls._table = [bytes(cls._to_rgba(value)) for value in range(0x10000)]
+        values = array.array("H", bytes(data))
+        if sys.byteorder == "little":
+            values.byteswap()
+        pixels = [None] * (width * height)
+        for value, pos in zip(values, cls._get_order(width, height)):
+            pixels[pos] = cls._table[value]
+        return b"".join(pixels)
+
+    @classmethod
+    def encode(cls, rgba, width, height):
+        """Encodes RGBA8 pixels to RGB5A3.
+
+        Args:
+            rgba (bytes): RGBA8 pixels, row by row
+            width (int): Image width
+            height (int): Image height
+
+        Returns:
+            bytes: RGB5A3 image data
+        """
+        cls._check_size(width, height)
+        if len(rgba) != width * height * 4:
+            raise ValueError("Data must be {0} bytes long.".format(width * height * 4))
+
+        if numpy is not None:
+            pixels = numpy.frombuffer(bytes(rgba), dtype=numpy.uint8)
+            # (tile row, y, tile column, x, channel) -> (tile row, tile column, y, x, channel)
+            pixels = pixels.reshape(height // cls.TILESIZE, cls.TILESIZE, width // cls.TILESIZE, cls.TILESIZE, 4)
+            pixels = pixels.transpose(0, 2, 1, 3, 4).reshape(-1, 4).astype(numpy.uint16)
+            r, g, b, a = pixels[:, 0], pixels[:, 1], pixels[:, 2], pixels[:, 3]
+            value = numpy.where(
+                a >= 0xE0,
+                0x8000 | ((r >> 3) << 10) | ((g >> 3) << 5) | (b >> 3),
+                ((a >> 5) << 12) | ((r >> 4) << 8) | ((g >> 4) << 4) | (b >> 4)
+            )
+            return value.astype(">u2").tobytes()
+
+        rgba = bytes(rgba)
+        values = array.array("H", [
+            cls._from_rgba(rgba[pos * 4], rgba[pos * 4 + 1], rgba[pos * 4 + 2], rgba[pos * 4 + 3])
+            for pos in cls._get_order(width, height)
+        ])
+        if sys.byteorder == "little":
+            values.byteswap()
+        return values.tobytes()
+
+
+class ECC:
+    """ECDSA on the sect233r1 curve, which is used for the Wii's certificates and signatures.
+       Points are (x, y) tuples of field elements in GF(2^233) stored as integers, None is the point at infinity.
+
+       Scalar multiplications use precomputed tables of all 4 bit window multiples of a point. The table of the
+       generator is built once, tables of public keys are cached, so verifying many signatures of the same key
+       (e.g. all savegames of a console) only costs additions.
+       Reference: https://www.secg.org/sec2-v2.pdf
+    """
+    M = 233
+    POLY = (1 << 233) | (1 << 74) | 1
+    MASK = (1 << 233) - 1
+    A = 1
+    B = 0x066647EDE6C332C7F8C0923BB58213B333B20E9CE4281FE115F7D8F90AD
+    G = (0x0FAC9DFCBAC8313BB2139F1BB755FEF65BC391F8B36F8F8EB7371FD558B,
+         0x1006A08A41903350678E58528BEBF8A0BEFF867A7CA36716F7E01F81052)
+    N = 0x1000000000000000000000000000013E974E72F8A6922031D2603CFE0D7
+    KEYSIZE = 30
+    WINDOW = 4
+    CACHESIZE = 64
+
+    _generator_table = None  # Never evicted
+    _tables = OrderedDict()  # Least recently used public keys are evicted first
+
+    @classmethod
+    def _reduce(cls, value):
+        """Helper function: Reduces a polynomial modulo x^233 + x^74 + 1."""
+        while value >> cls.M:
+            high = value >> cls.M
+            value = (value & cls.MASK) ^ high ^ (high << 74)
+        return value
+
+    @classmethod
+    def _mul(cls, a, b):
+        """Helper function: Multiplies two field elements, using 4 bits of b at once."""
+        multiples = [0, a]
+        for i in range(2, 16):
+            multiples.append(multiples[i >> 1] << 1 if not i & 1 else multiples[i - 1] ^ a)
+        product = 0
+        shift = (b.bit_length() + 3) & ~3
+        while shift:
+            shift -= 4
+            product = (product << 4) ^ multiples[(b >> shift) & 0xF]
+        return cls._reduce(product)
+
+    @classmethod
+    def _sqr(cls, a):
+        """Helper function: Squares a field element by inserting a zero between all bits."""
+        return cls._reduce(int("0".join(format(a, "b")), 2))
+
+    @classmethod
+    def _inv(cls, a):
+        """Helper function: Inverts a field element with the extended Euclidean algorithm."""
+        if not a:
+            raise ZeroDivisionError("Zero has no inverse.")
+        u, v = a, cls.POLY
+        g1, g2 = 1, 0
+        while u != 1:
+            j = u.bit_length() - v.bit_length()
+            if j < 0:
+                u, v = v, u
+                g1, g2 = g2, g1
+                j = -j
+            u ^= v << j
+            g1 ^= g2 << j
+        return g1
+
+    @classmethod
+    def _add(cls, p, q):
+        """Helper function: Adds two points."""
+        if p is None:
+            return q
+        if q is None:
+            return p
+        x1, y1 = p
+        x2, y2 = q
+        if x1 == x2:
+            if y1 == y2:
+                return cls._double(p)
+            return None  # q == -p
+        lam = cls._mul(y1 ^ y2, cls._inv(x1 ^ x2))
+        x3 = cls._sqr(lam) ^ lam ^ x1 ^ x2 ^ cls.A
+        y3 = cls._mul(lam, x1 ^ x3) ^ x3 ^ y1
+        return x3, y3
+
+    @classmethod
+    def _double(cls, p):
+        """Helper function: Doubles a point."""
+        if p is None or p[0] == 0:
+            return None
+        x1, y1 = p
+        lam = x1 ^ cls._mul(y1, cls._inv(x1))
+        x3 = cls._sqr(lam) ^ lam ^ cls.A
+        y3 = cls._sqr(x1) ^ cls._mul(lam ^ 1, x3)
+        return x3, y3
+
+    @classmethod
+    def _get_table(cls, point):
+        """Helper function: Returns (and caches) j * 16^i * point for every window i and digit j."""
+        if point == cls.G:
+            if cls._generator_table is None:
+                cls._generator_table = cls._build_table(point)
+            return cls._generator_table
+
+        try:
+            table = cls._tables[point]
+        except KeyError:
+            pass
+        else:
+            cls._tables.move_to_end(point)
+            return table
+
+        table = cls._build_table(point)
+        if len(cls._tables) >= cls.CACHESIZE:
+            cls._tables.popitem(last=False)
+        cls._tables[point] = table
+        return table
+
+    @classmethod
+    def _build_table(cls, point):
+        """Helper function: Builds the table for _get_table."""
+        table = []
+        base = point
+        for i in range((cls.M + cls.WINDOW) // cls.WINDOW):
+            row = [None, base]
+            for j in range(2, 1 << cls.WINDOW):
+                row.append(cls._add(row[-1], base))
+            table.append(row)
+            base = cls._double(row[1 << (cls.WINDOW - 1)])
+        return table
+
+    @classmethod
+    def point_mul(cls, k, point, cache=True):
+        """Multiplies point by the scalar k.
+
+        Args:
+            k (int): Scalar
+            point (tuple): Point to multiply
+            cache (bool): Build and cache a precomputed table for point (worth it if it's used again)
+
+        Returns:
+            tuple: The resulting point
+        """
+        k %= cls.N
+        if cache or point == cls.G or point in cls._tables:
+            table = cls._get_table(point)
+            result = None
+            i = 0
+            while k:
+                result = cls._add(result, table[i][k & 0xF])
+                k >>= cls.WINDOW
+                i += 1
+            return result
+
+        result = None
+        for bit in reversed(range(k.bit_length())):
+            result = cls._double(result)
+            if (k >> bit) & 1:
+                result = cls._add(result, point)
+        return result
+
+    @classmethod
+    def is_on_curve(cls, point):
+        """Returns True if point satisfies y^2 + xy = x^3 + ax^2 + b."""
+        if point is None:
+            return True
+        x, y = point
+        x2 = cls._sqr(x)
+        return cls._sqr(y) ^ cls._mul(x, y) == cls._mul(x2, x) ^ cls._mul(cls.A, x2) ^ cls.B
+
+    @classmethod
+    def decode_point(cls, data):
+        """Decodes a 60 byte public key (X and Y, 30 bytes each) to a point."""
+        data = bytes(data)
+        if len(data) != cls.KEYSIZE * 2:
+            raise ValueError("Public key must be {0} bytes long.".format(cls.KEYSIZE * 2))
+        point = (int.from_bytes(data[:cls.KEYSIZE], byteorder="big"),
+                 int.from_bytes(data[cls.KEYSIZE:], byteorder="big"))
+        if not cls.is_on_curve(point):
+            raise ValueError("Public key is not on the curve.")
+        return point
+
+    @classmethod
+    def encode_point(cls, point):
+        """Encodes a point to a 60 byte public key."""
+        return point[0].to_bytes(cls.KEYSIZE, byteorder="big") + point[1].to_bytes(cls.KEYSIZE, byteorder="big")
+
+    @classmethod
+    def get_public_key(cls, private_key):
+        """Returns the 60 byte public key for a 30 byte private key."""
+        return cls.encode_point(cls.point_mul(int.from_bytes(private_key, byteorder="big"), cls.G))
+
+    @classmethod
+    def generate_private_key(cls):
+        """Returns a random 30 byte private key."""
+        while True:
+            key = int.from_bytes(os.urandom(cls.KEYSIZE), byteorder="big") % cls.N
+            if key:
+                return key.to_bytes(cls.KEYSIZE, byteorder="big")
+
+    @classmethod
+    def sign(cls, private_key, sha1hash):
+        """Signs a SHA-1 hash.
+
+        Args:
+            private_key (bytes): 30 byte private key
+            sha1hash (bytes): Hash to sign
+
+        Returns:
+            bytes: 60 byte signature (R and S, 30 bytes each)
+        """
+        d = int.from_bytes(private_key, byteorder="big")
+        e = int.from_bytes(sha1hash, byteorder="big")
+        while True:
+            k = int.from_bytes(os.urandom(cls.KEYSIZE), byteorder="big") % cls.N
+            if not k:
+                continue
+            r = cls.point_mul(k, cls.G)[0] % cls.N
+            if not r:
+                continue
+            s = (pow(k, cls.N - 2, cls.N) * (e + r * d)) % cls.N
+            if s:
+                return r.to_bytes(cls.KEYSIZE, byteorder="big") + s.to_bytes(cls.KEYSIZE, byteorder="big")
+
+    @classmethod
+    def verify(cls, public_key, sha1hash, signature, cache=True):
+        """Verifies the signature of a SHA-1 hash.
+
+        Args:
+            public_key (bytes or tuple): 60 byte public key or point
+            sha1hash (bytes): Signed hash
+            signature (bytes): 60 byte signature (R and S, 30 bytes each)
+            cache (bool): Cache the precomputed table of the public key
+
+        Returns:
+            bool: True if the signature is valid
+        """
+        signature = bytes(signature)
+        try:
+            point = public_key if isinstance(public_key, tuple) else cls.decode_point(public_key)
+        except ValueError:
+            return False
+        r = int.from_bytes(signature[:cls.KEYSIZE], byteorder="big")
+        s = int.from_bytes(signature[cls.KEYSIZE:cls.KEYSIZE * 2], byteorder="big")
+        if not 0 < r < cls.N or not 0 < s < cls.N:
+            return False
+
+        e = int.from_bytes(sha1hash, byteorder="big")
+        w = pow(s, cls.N - 2, cls.N)
+        result = cls._add(cls.point_mul(e * w, cls.G), cls.point_mul(r * w, point, cache=cache))
+        if result is None:
+            return False
+        return result[0] % cls.N == r
+
+    @classmethod
+    def verify_many(cls, items):
+        """Verifies many signatures at once. Tables of public keys that occur more than once are cached.
+
+        Args:
+            items (list): List of (public_key, sha1hash, signature) tuples
+
+        Returns:
+            list: List of booleans
+        """
+        counts = {}
+        for public_key, sha1hash, signature in items:
+            counts[bytes(public_key)] = counts.get(bytes(public_key), 0) + 1
+        return [cls.verify(public_key, sha1hash, signature, cache=counts[bytes(public_key)] > 1)
+                for public_key, sha1hash, signature in items]
+
+    @classmethod
+    def sha1(cls, data):
+        """Returns the SHA-1 hash of data."""
+        return Crypto.new_hash("sha1", data).digest()
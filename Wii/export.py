@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
+import mmap
 import os
+import tempfile
 from binascii import hexlify, unhexlify
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
 
 from .common import *
@@ -12,13 +15,16 @@ class Savegame:
 
        Args:
            file (str): Path to a file
+           workers (int[optional]): Decrypt/encrypt the files in a thread pool with this many threads
+           max_memory (int[optional]): Maximum number of bytes of decrypted file data to keep in memory. Files that
+               don't fit are decrypted to temporary files and mapped into memory (their data is a memoryview then)
     """
-    # TODO: Certificates at end of file
     # TODO: More functions for editing data
 
     BANNERMAGIC = b"WIBN"
     BACKUPMAGIC = b"Bk"
     FILEMAGIC = b"\x03\xad\xf1\x7e"
+    CERTSIZE = 0x340  # Signature + NG certificate + AP certificate
 
     class Header(BigEndianStructure):
 
@@ -57,6 +63,10 @@ class Savegame:
                 return output
 
         class Banner(BigEndianStructure):
+            BANNERWIDTH = 192
+            BANNERHEIGHT = 64
+            ICONSIZE = 48
+
             _pack_ = 1
             _fields_ = [
                 ("magic", ARRAY(c_char, 4)),
@@ -91,6 +101,30 @@ class Savegame:
                 """Returns the game title."""
                 return bytes(self.gameSubTitle).rstrip(b"\x00").decode("utf-16-be")
 
+            def get_banner_rgba(self):
+                """Returns the banner as RGBA8 pixels (192x64)."""
+                return RGB5A3.decode(bytes(self.banner), self.BANNERWIDTH, self.BANNERHEIGHT)
+
+            def get_icon_rgba(self, num=0):
+                """Returns icon num (0-7) as RGBA8 pixels (48x48)."""
+                if not 0 <= num <= 7:
+                    raise ValueError("Icon must be between 0 and 7.")
+                return RGB5A3.decode(bytes(getattr(self, "icon{0}".format(num))), self.ICONSIZE, self.ICONSIZE)
+
+            def set_banner_rgba(self, rgba):
+                """Sets the banner from RGBA8 pixels (192x64). NOTE: MD5 has to be updated!"""
+                self.banner = ARRAY(c_byte, sizeof(self.banner)).from_buffer_copy(
+                    RGB5A3.encode(rgba, self.BANNERWIDTH, self.BANNERHEIGHT)
+                )
+
+            def set_icon_rgba(self, num, rgba):
+                """Sets icon num (0-7) from RGBA8 pixels (48x48). NOTE: MD5 has to be updated!"""
+                if not 0 <= num <= 7:
+                    raise ValueError("Icon must be between 0 and 7.")
+                setattr(self, "icon{0}".format(num), ARRAY(c_byte, self.ICONSIZE * self.ICONSIZE * 2).from_buffer_copy(
+                    RGB5A3.encode(rgba, self.ICONSIZE, self.ICONSIZE)
+                ))
+
             def __repr__(self):
                 return "Savegame Banner Header for {0}".format(self.get_game_title())
 
@@ -102,32 +136,46 @@ class Savegame:
 
                 return output
 
+        md5_outdated = False
+
         _pack_ = 1
         _fields_ = [
             ("main", MainHeader),
             ("banner", Banner)
         ]
 
-        def set_title(self, title):
-            """Sets the game's title and updates the MD5."""
+        def set_title(self, title, update_md5=True):
+            """Sets the game's title and updates the MD5. With update_md5=False, the MD5 is only updated by
+               flush() or when the header is packed (for changing several fields at once).
+            """
             if len(title) > 32:
                 raise ValueError("Game title must be < 32 characters.")
 
             self.banner.gameTitle = pad_to_cbyte_array(title.encode("utf-16-be"), 64)
-            self.update_md5()
+            self._changed(update_md5)
 
-        def set_subtitle(self, subtitle):
-            """Sets the game's subtitle and updates the MD5."""
+        def set_subtitle(self, subtitle, update_md5=True):
+            """Sets the game's subtitle and updates the MD5. With update_md5=False, the MD5 is only updated by
+               flush() or when the header is packed (for changing several fields at once).
+            """
             if len(subtitle) > 32:
                 raise ValueError("Game sub title must be < 32 characters.")
 
             self.banner.gameSubTitle = pad_to_cbyte_array(subtitle.encode("utf-16-be"), 64)
-            self.update_md5()
+            self._changed(update_md5)
+
+        def _changed(self, update_md5):
+            """Helper function: Updates the MD5 or marks it as outdated after the banner was changed."""
+            if update_md5:
+                self.update_md5()
+            else:
+                self.md5_outdated = True
 
         def pack(self, encrypt=True):
-            """Optionally encrypts data before packing."""
+            """Optionally encrypts data before packing. Updates the MD5 first if needed."""
+            self.flush()
             if encrypt:
-                pack = Crypto.encrypt_data(SDKEY, SDIV, bytes(self), align=True)
+                pack = Crypto.encrypt_data(SDKEY, SDIV, self, align=True)
             else:
                 pack = bytes(self)
             return pack
@@ -140,13 +188,17 @@ class Savegame:
 
         def generate_md5(self):
             """Generates the md5sum."""
-            headercopy = copy(self)
-            headercopy.main.md5 = ARRAY(c_byte, sizeof(headercopy.main.md5)).from_buffer_copy(MD5BLANKER)
-            return Crypto.create_md5hash(headercopy.pack(encrypt=False))
+            return Crypto.create_md5hash(self, blank_offset=type(self).main.offset + self.MainHeader.md5.offset)
 
         def update_md5(self):
             """Updates the md5sum in the Struct."""
             self.main.md5 = ARRAY(c_byte, sizeof(self.main.md5)).from_buffer_copy(self.generate_md5())
+            self.md5_outdated = False
+
+        def flush(self):
+            """Updates the md5sum if the title or subtitle were changed since the last update."""
+            if self.md5_outdated:
+                self.update_md5()
 
         def __repr__(self):
             return "Savegame Header for {0}".format(self.banner.get_game_title())
@@ -290,13 +342,323 @@ class Savegame:
         def __repr__(self):
             return self.get_name()
 
-    def __init__(self, file):
+    class FileIndex:
+        """Indexes the files of a savegame without decrypting anything. Single files can then be extracted
+           by seeking directly to their data.
+
+           Args:
+               file (str): Path to a file
+        """
+
+        def __init__(self, file):
+            self.file = str(file)
+            self.files = []
+            self.names = {}
+
+            with open(self.file, "rb") as fp:
+                # Skip the encrypted header, BkHeader and file headers are unencrypted
+                fp.seek(sizeof(Savegame.Header))
+                self.bkHeader = Savegame.BkHeader.from_buffer_copy(fp.read(sizeof(Savegame.BkHeader)))
+
+                if self.bkHeader.magic != Savegame.BACKUPMAGIC:
+                    raise Exception("This is not a valid Wii savegame (wrong backup magic).")
+
+                offset = fp.tell()
+                for i in range(self.bkHeader.filesCount):
+                    fp.seek(offset)
+                    filehdr = fp.read(sizeof(Savegame.File))
+                    file = Savegame.File.from_buffer_copy(filehdr)
+                    if bytes(file.header.magic) != Savegame.FILEMAGIC:
+                        raise Exception("This is not a valid Wii savegame (wrong file magic for {0}).".format(
+                            file.get_name()
+                        ))
+                    file.iv = filehdr[0x050:0x050 + 16]  # IV is always at 0x050 in the file header
+                    file.offset = offset + sizeof(Savegame.File)
+                    self.files.append(file)
+                    self.names[file.get_name()] = file
+                    offset = file.offset + file.get_size()
+
+        def extract(self, name, target):
+            """Decrypts a single file to target, which can be a path or a file object. Returns the number of bytes
+               written.
+            """
+            try:
+                file = self.names[name]
+            except KeyError:
+                raise LookupError("File not found.")
+
+            if not file.is_file():
+                raise ValueError("{0} is a directory.".format(name))
+
+            with open(self.file, "rb") as fp:
+                fp.seek(file.offset)
+                if hasattr(target, "write"):
+                    return Crypto.decrypt_stream(SDKEY, file.iv, fp, target, file.get_size(), file.header.size)
+                with open(str(target), "wb") as dst:
+                    return Crypto.decrypt_stream(SDKEY, file.iv, fp, dst, file.get_size(), file.header.size)
+
+        def __getitem__(self, name):
+            return self.names[name]
+
+        def __iter__(self):
+            return iter(self.files)
+
+        def __len__(self):
+            return len(self.files)
+
+        def __repr__(self):
+            return "Savegame File Index for {0} ({1} file{2})".format(
+                self.bkHeader.get_gameid(),
+                len(self.files),
+                "" if len(self.files) == 1 else "s"
+            )
+
+    class Builder:
+        """Builds a new savegame from a header template and files on disk. File data is encrypted in chunks
+           while writing, so memory usage stays constant regardless of the file sizes.
+
+           Args:
+               header (Savegame.Header): Header to use as template (title, banner, icons...)
+               bkheader (Savegame.BkHeader): Backup header to use as template (Game ID, Wii ID, MAC address...)
+               directory (str[optional]): Directory to add all files from
+        """
+
+        NAMELENGTH = 0x45  # Name is followed by the IV at 0x050 in the file header
+        PERMISSIONS = 0x3C
+
+        def __init__(self, header, bkheader, directory=None):
+            self.header = copy(header)
+            self.bkHeader = copy(bkheader)
+            self.files = []
+            if directory:
+                self.add_directory(directory)
+
+        def _get_position(self, name):
+            """Helper function: Returns the index of name in self.files or -1."""
+            for i, file in enumerate(self.files):
+                if file[0] == name:
+                    return i
+            return -1
+
+        def _add(self, name, path, filetype, permissions, attribute):
+            """Helper function for add_file and add_folder. Replaces existing entries."""
+            if len(name.encode()) >= self.NAMELENGTH:
+                raise ValueError("File name must be < {0} characters.".format(self.NAMELENGTH))
+
+            entry = (name, path, filetype, permissions, attribute)
+            position = self._get_position(name)
+            if position > -1:
+                self.files[position] = entry
+            else:
+                self.files.append(entry)
+
+        def add_file(self, name, path, permissions=PERMISSIONS, attribute=0):
+            """Adds the file at path as name to the savegame. Replaces the file if it already exists."""
+            if not os.path.isfile(str(path)):
+                raise FileNotFoundError("{0} does not exist.".format(path))
+            self._add(name, str(path), 1, permissions, attribute)
+
+        def add_folder(self, name, permissions=PERMISSIONS, attribute=0):
+            """Adds an empty folder to the savegame."""
+            self._add(name, None, 2, permissions, attribute)
+
+        def add_directory(self, directory):
+            """Adds all files and folders in directory to the savegame."""
+            directory = str(directory)
+            for root, dirs, files in os.walk(directory):
+                dirs.sort()
+                relpath = os.path.relpath(root, directory).replace(os.sep, "/")
+                prefix = "" if relpath == "." else relpath + "/"
+                for dirname in dirs:
+                    self.add_folder(prefix + dirname)
+                for filename in sorted(files):
+                    self.add_file(prefix + filename, os.path.join(root, filename))
+
+        def remove_file(self, name):
+            """Removes a file or folder from the savegame."""
+            position = self._get_position(name)
+            if position == -1:
+                raise LookupError("File not found.")
+            del self.files[position]
+
+        def dump(self, filename, ng_private_key=None, ng_certificate=None, ap_private_key=None):
+            """Writes the encrypted savegame to filename. Returns the filename. Without ng_private_key, the savegame
+               is unsigned: no signature and certificates are written and totalSize doesn't include them.
+
+            Args:
+                filename (str): Path to the output file
+                ng_private_key (bytes[optional]): 30 byte private key of the console to sign the savegame with
+                ng_certificate (Savegame.Certificate[optional]): NG certificate of the console, needed for signing
+                ap_private_key (bytes[optional]): 30 byte AP private key. Defaults to a random one
+            """
+            if ng_private_key is not None and ng_certificate is None:
+                raise ValueError("NG certificate is needed for signing.")
+
+            sizes = []
+            for name, path, filetype, permissions, attribute in self.files:
+                sizes.append(os.path.getsize(path) if path else 0)
+
+            self.bkHeader.filesCount = len(self.files)
+            self.bkHeader.filesSize = sum(sizeof(Savegame.File) + align_value(size) for size in sizes)
+            self.bkHeader.totalSize = sizeof(self.bkHeader) + self.bkHeader.filesSize
+            if ng_private_key is not None:
+                self.bkHeader.totalSize += Savegame.CERTSIZE
+            self.header.update_md5()
+
+            with open(str(filename), "w+b") as file:
+                file.write(self.header.pack())
+                file.write(self.bkHeader.pack())
+
+                for (name, path, filetype, permissions, attribute), size in zip(self.files, sizes):
+                    iv = os.urandom(16)
+                    file_obj = Savegame.File()
+                    file_obj.header.magic = ARRAY(c_byte, 4).from_buffer_copy(Savegame.FILEMAGIC)
+                    file_obj.header.size = size
+                    file_obj.header.permissions = permissions
+                    file_obj.header.attribute = attribute
+                    file_obj.header.type = filetype
+                    file_obj.header.namedata = pad_to_cbyte_array(name.encode().ljust(self.NAMELENGTH, b"\x00") + iv,
+                                                                  sizeof(file_obj.header.namedata))
+                    file.write(file_obj.header.pack())
+                    if path:
+                        with open(path, "rb") as src:
+                            Crypto.encrypt_stream(SDKEY, iv, src, file, size)
+
+                if ng_private_key is not None:
+                    file.seek(sizeof(Savegame.Header))
+                    sha1hash = Crypto.new_hash("sha1")
+                    remaining = sizeof(self.bkHeader) + self.bkHeader.filesSize
+                    while remaining > 0:
+                        chunk = file.read(min(CHUNKSIZE, remaining))
+                        sha1hash.update(chunk)
+                        remaining -= len(chunk)
+                    file.seek(0, os.SEEK_END)
+                    file.write(Savegame._sign(ECC.sha1(sha1hash.digest()), ng_private_key, ng_certificate,
+                                              ap_private_key))
+
+                return file.name
+
+        def __repr__(self):
+            return "Savegame Builder for {0} ({1} file{2})".format(
+                self.bkHeader.get_gameid(),
+                len(self.files),
+                "" if len(self.files) == 1 else "s"
+            )
+
+    class Signature(BigEndianStructure):
+        _pack_ = 1
+        _fields_ = [
+            ("signature", ARRAY(c_byte, 60)),
+            ("padding", ARRAY(c_byte, 4))
+        ]
+
+    class Certificate(BigEndianStructure):
+        _pack_ = 1
+        _fields_ = [
+            ("signatureType", c_uint32),
+            ("signature", ARRAY(c_byte, 60)),
+            ("padding1", ARRAY(c_byte, 64)),
+            ("issuer", ARRAY(c_char, 64)),
+            ("keyType", c_uint32),
+            ("name", ARRAY(c_char, 64)),
+            ("keyId", c_uint32),
+            ("publicKey", ARRAY(c_byte, 60)),
+            ("padding2", ARRAY(c_byte, 60))
+        ]
+
+        SIGNED = 0x80  # Signature covers everything from the issuer on
+
+        def get_issuer(self):
+            """Returns the issuer of the certificate."""
+            return self.issuer.decode()
+
+        def get_name(self):
+            """Returns the name of the certificate."""
+            return self.name.decode()
+
+        def get_public_key(self):
+            """Returns the public key as bytes."""
+            return bytes(self.publicKey)
+
+        def get_signed_hash(self):
+            """Returns the SHA-1 hash of the signed part of the certificate."""
+            return ECC.sha1(self.pack()[self.SIGNED:])
+
+        def sign(self, private_key):
+            """Signs the certificate with the issuer's private key."""
+            self.signatureType = 0x10002  # ECC
+            self.signature = ARRAY(c_byte, 60).from_buffer_copy(ECC.sign(private_key, self.get_signed_hash()))
+
+        def __repr__(self):
+            return "Certificate {0} issued by {1}".format(self.get_name(), self.get_issuer())
+
+    class Diff:
+        """Result of Savegame.diff(). Changed byte ranges are (start, end) tuples with an exclusive end and are
+           relative to the decrypted data.
+        """
+
+        def __init__(self):
+            self.header = []
+            self.bkHeader = []
+            self.fileHeaders = {}
+            self.files = {}
+            self.added = []
+            self.removed = []
+
+        def is_equal(self):
+            """Returns True if both savegames have the same content."""
+            if self.header or self.bkHeader or self.added or self.removed:
+                return False
+            for ranges in list(self.fileHeaders.values()) + list(self.files.values()):
+                if ranges:
+                    return False
+            return True
+
+        def get_changed_files(self):
+            """Returns the names of files that exist in both savegames, but differ."""
+            changed = []
+            for name in self.files:
+                if self.files[name] or self.fileHeaders[name]:
+                    changed.append(name)
+            return changed
+
+        def __repr__(self):
+            if self.is_equal():
+                return "Savegame Diff: Equal"
+            return "Savegame Diff: {0} changed, {1} added, {2} removed".format(
+                len(self.get_changed_files()),
+                len(self.added),
+                len(self.removed)
+            )
+
+        def __str__(self):
+            output = "Savegame Diff:\n"
+            if self.is_equal():
+                output += "  Savegames are equal\n"
+                return output
+
+            if self.header:
+                output += "  Header: {0}\n".format(self.header)
+            if self.bkHeader:
+                output += "  Backup header: {0}\n".format(self.bkHeader)
+            for name in self.get_changed_files():
+                output += "  Changed {0}: {1}\n".format(name, self.fileHeaders[name] + self.files[name])
+            for name in self.added:
+                output += "  Added {0}\n".format(name)
+            for name in self.removed:
+                output += "  Removed {0}\n".format(name)
+
+            return output
+
+    def __init__(self, file, workers=None, max_memory=None):
+        self.workers = workers
         fp = open(str(file), 'r+b')
 
         # Decrypt header
-        headerbuffer = fp.read(0xF0C0)
-        headerbuffer = Crypto.decrypt_data(SDKEY, SDIV, headerbuffer, align=True)
-        self.header = self.Header.from_buffer_copy(headerbuffer)
+        headerbuffer = bytearray(sizeof(self.Header))
+        fp.readinto(headerbuffer)
+        Crypto.decrypt_data(SDKEY, SDIV, headerbuffer, output=headerbuffer)
+        self.header = self.Header.from_buffer(headerbuffer)
 
         if self.header.banner.magic != self.BANNERMAGIC:
             raise Exception("This is not a valid Wii savegame (wrong banner magic).")
@@ -313,20 +675,321 @@ class Savegame:
 
         # Files
         self.files = []
+        memory_files = []
+        encrypted_files = []
+        budget = max_memory
         for i in range(self.bkHeader.filesCount):
             filehdr = fp.read(sizeof(self.File))
             self.files.append(self.File.from_buffer_copy(filehdr))
             self.files[i].iv = filehdr[0x050:0x050 + 16]  # IV is always at 0x050 in the file header
-            filedata = fp.read(self.files[i].get_size())
-            dec_filedata = Crypto.decrypt_data(SDKEY, self.files[i].iv, filedata)
-            self.files[i].data = dec_filedata
+            if budget is not None and self.files[i].get_size() > budget:
+                self.files[i].data = self._spill_file(fp, self.files[i])
+            else:
+                if budget is not None:
+                    budget -= self.files[i].get_size()
+                memory_files.append(self.files[i])
+                encrypted_files.append(bytearray(self.files[i].get_size()))
+                fp.readinto(encrypted_files[-1])
+
+        # Every file has its own IV, so they can be decrypted independently
+        for file_obj, dec_filedata in zip(memory_files, self._map(self._decrypt_file, memory_files, encrypted_files)):
+            file_obj.data = dec_filedata
 
         for file in self.files:
             if bytes(file.header.magic) != self.FILEMAGIC:
                 raise Exception("This is not a valid Wii savegame (wrong file magic for {0}).".format(file.get_name()))
 
+        # Signature and certificates are kept as-is
+        self.certificates = fp.read()
+
         fp.close()
 
+    @classmethod
+    def load_many(cls, files, workers=4):
+        """Loads multiple savegames at once, decrypting them in a thread pool with `workers` threads.
+           Returns a list of Savegame objects in the same order as `files`.
+        """
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(cls, files))
+
+    @staticmethod
+    def _spill_file(fp, file_obj):
+        """Helper function: Decrypts the data of file_obj from fp into an anonymous temporary file and returns
+           a memoryview of it, so it doesn't count against the process' heap.
+        """
+        size = file_obj.get_size()
+        if not size:
+            return b""
+        with tempfile.TemporaryFile() as tmp:
+            Crypto.decrypt_stream(SDKEY, file_obj.iv, fp, tmp, size)
+            tmp.flush()
+            return memoryview(mmap.mmap(tmp.fileno(), size))
+
+    @staticmethod
+    def _decrypt_file(file_obj, data):
+        """Helper function: Decrypts the data of file_obj in-place."""
+        return Crypto.decrypt_data(SDKEY, file_obj.iv, data, output=data)
+
+    def _map(self, func, *iterables):
+        """Helper function: Maps func over iterables, using a thread pool if self.workers is set.
+           The AES functions release the GIL, so threads are enough to use multiple cores.
+        """
+        if self.workers and self.workers > 1 and len(iterables[0]) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                return list(pool.map(func, *iterables))
+        return list(map(func, *iterables))
+
+    @staticmethod
+    def _diff_bytes(data1, data2, offset=0):
+        """Helper function: Returns the ranges in which data1 and data2 differ. Extra data in the longer one is
+           reported as changed.
+        """
+        ranges = []
+        length = min(len(data1), len(data2))
+        for block in range(0, length, 64):
+            if data1[block:block + 64] == data2[block:block + 64]:
+                continue
+            for pos in range(block, min(block + 64, length)):
+                if data1[pos] == data2[pos]:
+                    continue
+                if ranges and ranges[-1][1] == offset + pos:
+                    ranges[-1] = (ranges[-1][0], offset + pos + 1)
+                else:
+                    ranges.append((offset + pos, offset + pos + 1))
+        if len(data1) != len(data2):
+            if ranges and ranges[-1][1] == offset + length:
+                ranges[-1] = (ranges[-1][0], offset + max(len(data1), len(data2)))
+            else:
+                ranges.append((offset + length, offset + max(len(data1), len(data2))))
+        return ranges
+
+    @staticmethod
+    def _diff_encrypted(iv1, data1, size1, iv2, data2, size2):
+        """Helper function: Returns the changed ranges of the decrypted data1 and data2 (truncated to size1 and
+           size2). With the same IV, equal ciphertext blocks can be skipped and only the blocks around a changed one
+           are decrypted, since a CBC plaintext block only depends on its own and the previous ciphertext block.
+        """
+        if iv1 != iv2:
+            return Savegame._diff_bytes(Crypto.decrypt_data(SDKEY, iv1, data1)[:size1],
+                                        Crypto.decrypt_data(SDKEY, iv2, data2)[:size2])
+        if data1 == data2 and size1 == size2:
+            return []
+
+        # Find the changed ciphertext blocks, the next plaintext block is affected as well
+        length = min(len(data1), len(data2))
+        blocks = set()
+        for window in range(0, length, 0x1000):
+            if data1[window:window + 0x1000] == data2[window:window + 0x1000]:
+                continue
+            for block in range(window, min(window + 0x1000, length), 16):
+                if data1[block:block + 16] != data2[block:block + 16]:
+                    blocks.add(block)
+                    blocks.add(block + 16)
+
+        # Decrypt runs of consecutive blocks
+        ranges = []
+        blocks = sorted(block for block in blocks if block < length)
+        start = 0
+        while start < len(blocks):
+            end = start
+            while end + 1 < len(blocks) and blocks[end + 1] == blocks[end] + 16:
+                end += 1
+            first, last = blocks[start], blocks[end] + 16
+            iv = iv1 if first == 0 else data1[first - 16:first]
+            plain1 = Crypto.decrypt_data(SDKEY, iv, data1[first:last], align=False)[:max(0, size1 - first)]
+            plain2 = Crypto.decrypt_data(SDKEY, iv, data2[first:last], align=False)[:max(0, size2 - first)]
+            ranges += Savegame._diff_bytes(plain1[:len(plain2)], plain2[:len(plain1)], first)
+            start = end + 1
+
+        if size1 != size2:
+            ranges.append((min(size1, size2), max(size1, size2)))
+
+        merged = []
+        for rng in sorted(ranges):
+            if merged and rng[0] <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], rng[1]))
+            else:
+                merged.append(rng)
+        return merged
+
+    @staticmethod
+    def diff(savegame1, savegame2):
+        """Compares two savegames without decrypting them completely. Header and files are compared by their
+           ciphertexts, only differing blocks are decrypted to find the changed byte ranges.
+
+        Args:
+            savegame1 (str or Savegame.FileIndex): Path to the first savegame or its index
+            savegame2 (str or Savegame.FileIndex): Path to the second savegame or its index
+
+        Returns:
+            Savegame.Diff: The differences
+        """
+        if not isinstance(savegame1, Savegame.FileIndex):
+            savegame1 = Savegame.FileIndex(savegame1)
+        if not isinstance(savegame2, Savegame.FileIndex):
+            savegame2 = Savegame.FileIndex(savegame2)
+
+        diff = Savegame.Diff()
+        with open(savegame1.file, "rb") as fp1, open(savegame2.file, "rb") as fp2:
+            headersize = sizeof(Savegame.Header)
+            diff.header = Savegame._diff_encrypted(SDIV, fp1.read(headersize), headersize,
+                                                   SDIV, fp2.read(headersize), headersize)
+            diff.bkHeader = Savegame._diff_bytes(savegame1.bkHeader.pack(), savegame2.bkHeader.pack())
+
+            for file1 in savegame1:
+                name = file1.get_name()
+                if name not in savegame2.names:
+                    diff.removed.append(name)
+                    continue
+
+                # The IV is not part of the file's content
+                file2 = savegame2[name]
+                header1, header2 = bytearray(file1.header.pack()), bytearray(file2.header.pack())
+                header1[0x050:0x050 + 16] = header2[0x050:0x050 + 16] = b"\x00" * 16
+                diff.fileHeaders[name] = Savegame._diff_bytes(header1, header2)
+
+                fp1.seek(file1.offset)
+                fp2.seek(file2.offset)
+                diff.files[name] = Savegame._diff_encrypted(file1.iv, fp1.read(file1.get_size()), file1.header.size,
+                                                            file2.iv, fp2.read(file2.get_size()), file2.header.size)
+
+            for file2 in savegame2:
+                if file2.get_name() not in savegame1.names:
+                    diff.added.append(file2.get_name())
+
+        return diff
+
+    def get_signature(self):
+        """Returns the Signature of the savegame or None if the savegame is unsigned."""
+        if len(self.certificates) < self.CERTSIZE:
+            return None
+        return self.Signature.from_buffer_copy(self.certificates)
+
+    def get_ng_certificate(self):
+        """Returns the console's NG Certificate or None if the savegame is unsigned."""
+        if len(self.certificates) < self.CERTSIZE:
+            return None
+        return self.Certificate.from_buffer_copy(self.certificates, sizeof(self.Signature))
+
+    def get_ap_certificate(self):
+        """Returns the AP Certificate (signed by NG, signs the savegame) or None if the savegame is unsigned."""
+        if len(self.certificates) < self.CERTSIZE:
+            return None
+        return self.Certificate.from_buffer_copy(self.certificates, sizeof(self.Signature) + sizeof(self.Certificate))
+
+    def get_signed_hash(self):
+        """Returns the hash that is signed by the AP key: SHA-1(SHA-1(BkHeader + encrypted files))."""
+        files = self._map(lambda file: file.pack(encrypt=True), self.files)
+        return ECC.sha1(ECC.sha1(self.bkHeader.pack() + b"".join(files)))
+
+    @classmethod
+    def _get_verifications(cls, signed_hash, certificates, ms_public_key=None):
+        """Helper function: Returns the (public key, hash, signature) tuples needed to verify a savegame."""
+        if len(certificates) < cls.CERTSIZE:
+            return None
+        signature = cls.Signature.from_buffer_copy(certificates)
+        ng_cert = cls.Certificate.from_buffer_copy(certificates, sizeof(cls.Signature))
+        ap_cert = cls.Certificate.from_buffer_copy(certificates, sizeof(cls.Signature) + sizeof(cls.Certificate))
+
+        verifications = [
+            (ng_cert.get_public_key(), ap_cert.get_signed_hash(), bytes(ap_cert.signature)),
+            (ap_cert.get_public_key(), signed_hash, bytes(signature.signature))
+        ]
+        if ms_public_key:
+            verifications.append((bytes(ms_public_key), ng_cert.get_signed_hash(), bytes(ng_cert.signature)))
+        return verifications
+
+    def verify(self, ms_public_key=None):
+        """Verifies the savegame's signature and the AP certificate. If the public key of the issuer of the
+           NG certificate (Root-CA00000001-MS00000002) is given, the NG certificate is verified as well.
+           Returns True if everything is valid.
+        """
+        verifications = self._get_verifications(self.get_signed_hash(), self.certificates, ms_public_key)
+        if not verifications:
+            return False
+        ap_public_key = verifications[1][0]  # Unique to every savegame, only the NG and MS keys are worth caching
+        return all(ECC.verify(public_key, sha1hash, signature, cache=public_key != ap_public_key)
+                   for public_key, sha1hash, signature in verifications)
+
+    @classmethod
+    def _read_verifications(cls, file, ms_public_key=None):
+        """Helper function: Reads a savegame without decrypting it and returns its verifications."""
+        with open(str(file), "rb") as fp:
+            fp.seek(sizeof(cls.Header))
+            bkheader = fp.read(sizeof(cls.BkHeader))
+            filessize = cls.BkHeader.from_buffer_copy(bkheader).filesSize
+            sha1hash = Crypto.new_hash("sha1", bkheader)
+            while filessize > 0:
+                chunk = fp.read(min(CHUNKSIZE, filessize))
+                if not chunk:
+                    break
+                sha1hash.update(chunk)
+                filessize -= len(chunk)
+            return cls._get_verifications(ECC.sha1(sha1hash.digest()), fp.read(cls.CERTSIZE), ms_public_key)
+
+    @classmethod
+    def verify_file(cls, file, ms_public_key=None):
+        """Like verify(), but works directly on a file without decrypting it."""
+        return cls.verify_many([file], ms_public_key)[0]
+
+    @classmethod
+    def verify_many(cls, files, ms_public_key=None):
+        """Verifies many savegame files without decrypting them. Public keys that occur more than once
+           (e.g. the NG key of a console) are only prepared once. Returns a list of booleans.
+        """
+        verifications = [cls._read_verifications(file, ms_public_key) for file in files]
+        items = []
+        for verification in verifications:
+            if verification:
+                items += verification
+        results = iter(ECC.verify_many(items))
+
+        valid = []
+        for verification in verifications:
+            if not verification:
+                valid.append(False)
+                continue
+            valid.append(all([next(results) for i in range(len(verification))]))
+        return valid
+
+    def resign(self, ng_private_key, ng_certificate=None, ap_private_key=None):
+        """Signs the savegame with a new AP key, which is certified with the console's NG key.
+
+        Args:
+            ng_private_key (bytes): 30 byte private key of the console
+            ng_certificate (Savegame.Certificate[optional]): NG certificate of the console.
+                Defaults to the one of the savegame
+            ap_private_key (bytes[optional]): 30 byte AP private key. Defaults to a random one
+        """
+        if ng_certificate is None:
+            ng_certificate = self.get_ng_certificate()
+            if ng_certificate is None:
+                raise ValueError("Savegame has no NG certificate, please pass one.")
+        self.certificates = self._sign(self.get_signed_hash(), ng_private_key, ng_certificate, ap_private_key,
+                                       self.get_ap_certificate())
+
+    @classmethod
+    def _sign(cls, signed_hash, ng_private_key, ng_certificate, ap_private_key=None, ap_certificate=None):
+        """Helper function: Signs signed_hash with a new AP key, which is certified with the NG key. Returns the
+           signature and the NG and AP certificates as bytes.
+        """
+        if ECC.get_public_key(ng_private_key) != ng_certificate.get_public_key():
+            raise ValueError("NG private key does not belong to the NG certificate.")
+
+        if ap_private_key is None:
+            ap_private_key = ECC.generate_private_key()
+        if ap_certificate is None:
+            ap_certificate = cls.Certificate()
+            ap_certificate.keyType = 2  # ECC
+            ap_certificate.name = b"AP0000000100000002"  # Exported by the System Menu
+        ap_certificate.issuer = "{0}-{1}".format(ng_certificate.get_issuer(), ng_certificate.get_name()).encode()
+        ap_certificate.publicKey = ARRAY(c_byte, 60).from_buffer_copy(ECC.get_public_key(ap_private_key))
+        ap_certificate.sign(ng_private_key)
+
+        signature = cls.Signature()
+        signature.signature = ARRAY(c_byte, 60).from_buffer_copy(ECC.sign(ap_private_key, signed_hash))
+        return signature.pack() + ng_certificate.pack() + ap_certificate.pack()
+
     def extract_files(self, directory, encrypt=False):
         """Extracts all files from the savegame to a directory. If `encrypt` is True, files will be encrypted."""
         if not os.path.isdir(directory):
@@ -336,7 +999,7 @@ class Savegame:
             if file_obj.is_file():
                 with open(str(os.path.join(directory, file_obj.get_name())), "wb") as file:
                     if encrypt:
-                        file.write(file_obj.encrypt_data())
+                        Crypto.encrypt_stream(SDKEY, file_obj.iv, file_obj.data, file, len(file_obj.data))
                     else:
                         file.write(file_obj.data)
             else:
@@ -350,15 +1013,23 @@ class Savegame:
         """Optionally encrypts the data before packing."""
         header = self.header.pack(encrypt=encrypt)
         bkheader = self.bkHeader.pack()
-        files = b""
-        for file in self.files:
-            files += file.pack(encrypt=encrypt)
-        return header + bkheader + files
+        files = b"".join(self._map(lambda file: file.pack(encrypt=encrypt), self.files))
+        return header + bkheader + files + self.certificates
 
     def dump(self, filename, encrypt=True):
-        """Dumps Struct to filename. Returns the filename. Defaults to encrypted."""
+        """Dumps Struct to filename. Returns the filename. Defaults to encrypted.
+           Files are written one by one in chunks, so the savegame is never completely in memory.
+        """
         with open(str(filename), "wb") as file:
-            file.write(self.pack(encrypt=encrypt))
+            file.write(self.header.pack(encrypt=encrypt))
+            file.write(self.bkHeader.pack())
+            for file_obj in self.files:
+                file.write(file_obj.header.pack())
+                if encrypt:
+                    Crypto.encrypt_stream(SDKEY, file_obj.iv, file_obj.data, file, len(file_obj.data))
+                else:
+                    file.write(file_obj.data)
+            file.write(self.certificates)
             return file.name
 
     def __repr__(self):
@@ -416,6 +1087,13 @@ class LocDat(BigEndianStructure):
         def __repr__(self):
             return self.get_id4()
 
+    EMPTY = b"\x00" * 4
+    BATCH_OPERATIONS = ["add_channel_by_id4", "add_channel_by_titleid", "move_channel", "delete_channel",
+                        "place_channel_by_id4", "place_channel_by_titleid", "place_channels", "compact"]
+    md5_outdated = False
+    _index = None
+    _index_duplicates = False
+
     _pack_ = 1
     _fields_ = [
         ("magic", ARRAY(c_char, 4)),
@@ -425,31 +1103,141 @@ class LocDat(BigEndianStructure):
     ]
 
     def get_md5_hash(self):
-        """Returns MD5 hash as string."""
+        """Returns MD5 hash as string. Updates it first if needed."""
+        self.flush()
         return hexlify(bytes(self.md5)).decode()
 
     def generate_md5(self):
         """Generates the md5sum."""
-        filecopy = copy(self)
-        filecopy.md5 = ARRAY(c_byte, sizeof(filecopy.md5)).from_buffer_copy(MD5BLANKER)
-        return Crypto.create_md5hash(filecopy.pack(encrypt=False))
+        return Crypto.create_md5hash(self, blank_offset=LocDat.md5.offset)
 
     def update_md5(self):
         """Updates the md5sum in the Struct."""
         self.md5 = ARRAY(c_byte, sizeof(self.md5)).from_buffer_copy(self.generate_md5())
+        self.md5_outdated = False
+
+    def flush(self):
+        """Updates the md5sum if channels were changed since the last update."""
+        if self.md5_outdated:
+            self.update_md5()
 
     def get_used_blocks(self):
         """Returns the number of used channel slots."""
-        used_blocks = 0
-        for channel in self.channels:
-            if channel.is_used():
-                used_blocks += 1
-        return used_blocks
+        return count_used_slots(self._get_raw_channels(), sizeof(self.Channel), 0, self.EMPTY)
 
     def get_free_blocks(self):
         """Returns the number of free channel slots."""
         return len(self.channels) - self.get_used_blocks()
 
+    def _get_raw_channels(self):
+        """Helper function: Returns a memoryview of the raw channel array (4 bytes per slot)."""
+        return memoryview(self).cast("B")[LocDat.channels.offset:LocDat.channels.offset + LocDat.channels.size]
+
+    def _get_index(self):
+        """Helper function: Returns a dict of raw ID4 -> slot for all used slots. It's built once from the raw
+           channel array and kept up to date by the methods of this class.
+        """
+        if self._index is None:
+            raw = self._get_raw_channels().tobytes()
+            self._index = {}
+            self._index_duplicates = False
+            for slot in range(len(self.channels)):
+                key = raw[slot * 4:slot * 4 + 4]
+                if key == self.EMPTY:
+                    continue
+                if key in self._index:  # Duplicates can't be updated incrementally, only the first one is found
+                    self._index_duplicates = True
+                else:
+                    self._index[key] = slot
+        return self._index
+
+    def _clear_caches(self):
+        """Helper function: Forgets everything derived from the raw channel array."""
+        self._index = None
+
+    def _changed(self):
+        """Helper function: Marks the MD5 as outdated after channels were changed."""
+        self.md5_outdated = True
+
+    def _update_index(self, key, old_slot=None, new_slot=None):
+        """Helper function: Moves key in the index from old_slot to new_slot (None for additions/deletions)."""
+        if self._index is None:
+            return
+        if self._index_duplicates:
+            self._index = None
+        elif new_slot is not None:
+            self._index[key] = new_slot
+        elif self._index.get(key) == old_slot:
+            del self._index[key]
+
+    def get_occupancy(self):
+        """Returns the occupancy bitmap of the channel slots (bit n is set if slot n is used)."""
+        occupancy = 0
+        for slot, id4 in enumerate(self._get_raw_channels().cast("I")):
+            if id4:
+                occupancy |= 1 << slot
+        return occupancy
+
+    def find_free_slots(self, count=1, strategy="first"):
+        """Returns the first slot of count consecutive free slots. Strategy can be "first" (first-fit) or
+           "best" (best-fit, uses the smallest gap that fits).
+        """
+        return find_free_slots(self.get_occupancy(), len(self.channels), count, strategy)
+
+    @staticmethod
+    def get_position(slot):
+        """Returns col, row and page of a slot."""
+        return slot % 4, (slot // 4) % 3, slot // 12
+
+    def place_channel_by_id4(self, id4, strategy="first"):
+        """Adds a channel by its ID4 to a free slot chosen by strategy (see find_free_slots). Returns the slot."""
+        slot = self.find_free_slots(strategy=strategy)
+        self._add_channel_by_id4_or_tid(id4, *self.get_position(slot))
+        return slot
+
+    def place_channel_by_titleid(self, tid, strategy="first"):
+        """Adds a channel by its lower Title ID to a free slot chosen by strategy (see find_free_slots).
+           Returns the slot.
+        """
+        slot = self.find_free_slots(strategy=strategy)
+        self._add_channel_by_id4_or_tid(tid, *self.get_position(slot), by_titleid=True)
+        return slot
+
+    def place_channels(self, tids, strategy="first", by_titleid=False):
+        """Adds multiple channels to consecutive free slots chosen by strategy (see find_free_slots).
+           Returns the first slot.
+
+        Args:
+            tids (list): ID4s or lower Title IDs
+            strategy (str): "first" or "best"
+            by_titleid (bool): tids are lower Title IDs instead of ID4s
+        """
+        keys = set()
+        for tid in tids:
+            key = tid.lower() if by_titleid else tid.upper()
+            if key in keys:
+                raise ValueError("{0} is given more than once.".format(tid))
+            keys.add(key)
+            try:
+                self._get_channel_by_id4_or_tid(tid, by_titleid=by_titleid)
+                raise Exception("Channel already exists.")
+            except LookupError:
+                pass
+
+        start = self.find_free_slots(len(tids), strategy)
+        for slot, tid in enumerate(tids, start):
+            self._add_channel_by_id4_or_tid(tid, *self.get_position(slot), by_titleid=by_titleid)
+        return start
+
+    def compact(self):
+        """Moves all channels to the front in one pass, closing the gaps between them but keeping their order."""
+        raw = self._get_raw_channels()
+        channels = b"".join(raw[i:i + 4] for i in range(0, len(raw), 4) if raw[i:i + 4] != self.EMPTY)
+        raw[:len(channels)] = channels
+        raw[len(channels):] = bytes(len(raw) - len(channels))
+        self._clear_caches()
+        self._changed()
+
     def _get_channel_by_id4_or_tid(self, search, by_titleid=False, return_index=False):
         """Helper function for get_channel_by_id4 and get_channel_by_titleid.
 
@@ -461,24 +1249,31 @@ class LocDat(BigEndianStructure):
         if by_titleid:
             if len(search) != 8:
                 raise ValueError("Lower Title ID must be 8 characters long.")
+            try:
+                key = unhexlify(search.encode())
+            except ValueError:
+                raise LookupError("Channel not found.")
         else:
             if len(search) != 4:
                 raise ValueError("ID4 must be 4 characters long.")
+            key = search.upper().encode()
 
-        for i, channel in enumerate(self.channels):
-            if by_titleid:
-                if channel.get_titleid() == search.lower():
-                    if return_index:
-                        return i
-                    else:
-                        return channel
-            else:
-                if channel.get_id4() == search.upper():
-                    if return_index:
-                        return i
-                    else:
-                        return channel
-        raise LookupError("Channel not found.")
+        if key == self.EMPTY:  # Only the lower Title ID of free slots can be zero
+            if not by_titleid or self.get_free_blocks() == 0:
+                raise LookupError("Channel not found.")
+            slot = next(i for i, channel in enumerate(self.channels) if not channel.is_used())
+        else:
+            slot = self._get_index().get(key)
+            if slot is None or self._get_raw_channels()[slot * 4:slot * 4 + 4] != key:
+                self._index = None  # Channel may have been changed directly, rescan before giving up
+                slot = self._get_index().get(key)
+            if slot is None:
+                raise LookupError("Channel not found.")
+
+        if return_index:
+            return slot
+        else:
+            return self.channels[slot]
 
     def get_channel_by_id4(self, id4):
         """Finds a channel by its ID4."""
@@ -531,7 +1326,8 @@ class LocDat(BigEndianStructure):
             self.channels[pos].id4 = ARRAY(c_byte, 4).from_buffer_copy(unhexlify(tid.encode()))
         else:
             self.channels[pos].id4 = ARRAY(c_byte, 4).from_buffer_copy(tid.encode())
-        self.update_md5()
+        self._update_index(bytes(self.channels[pos].id4), new_slot=pos)
+        self._changed()
 
     def add_channel_by_id4(self, id4, col, row, page):
         self._add_channel_by_id4_or_tid(id4, col, row, page)
@@ -560,12 +1356,35 @@ class LocDat(BigEndianStructure):
 
         self.channels[new_position] = self.channels[old_position]
         old_channel.delete()
-        self.update_md5()
+        self._update_index(bytes(new_channel.id4), old_position, new_position)
+        self._changed()
+
+    def delete_channel(self, col, row, page):
+        """Deletes the channel at col, row on page. Note that the Wii will re-populate it if it's on SD."""
+        if not 0 <= col <= 3 or not 0 <= row <= 2 or not 0 <= page <= 19:
+            raise ValueError("Out of bounds.")
+
+        position = (col + (row * 4) + (page * 12))
+        channel = self.channels[position]
+        if not channel.is_used():
+            raise LookupError("No channel on this position.")
+
+        key = bytes(channel.id4)
+        channel.delete()
+        self._update_index(key, old_slot=position)
+        self._changed()
+
+    def batch(self):
+        """Returns a Batch to queue adds, moves and deletes in a with block. They're validated and applied together
+           on commit with a single MD5 update and rolled back if one of them fails.
+        """
+        return Batch(self)
 
     def pack(self, encrypt=True):
-        """Optionally encrypts data before packing."""
+        """Optionally encrypts data before packing. Updates the MD5 first if needed."""
+        self.flush()
         if encrypt:
-            pack = Crypto.encrypt_data(SDKEY, SDIV, bytes(self), align=False)
+            pack = Crypto.encrypt_data(SDKEY, SDIV, self, align=False)
         else:
             pack = bytes(self)
         return pack
@@ -579,10 +1398,11 @@ class LocDat(BigEndianStructure):
     def __new__(cls, file=None):
         """Loads file intro Struct if given and decrypts it."""
         if file:
+            buffer = bytearray(sizeof(cls))
             with open(str(file), "rb") as fp:
-                buffer = fp.read((sizeof(cls)))
-            buffer = Crypto.decrypt_data(SDKEY, SDIV, buffer, align=False)
-            c_struct = cls.from_buffer_copy(buffer)
+                fp.readinto(buffer)
+            Crypto.decrypt_data(SDKEY, SDIV, buffer, align=False, output=buffer)
+            c_struct = cls.from_buffer(buffer)
             return c_struct
         else:
             return super().__new__(cls)
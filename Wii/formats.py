@@ -1,8 +1,18 @@
 #!/usr/bin/env python3
+import bisect
+import heapq
 import socket
+import struct
+import time
 from binascii import hexlify, unhexlify
 from datetime import datetime, timedelta
 from string import hexdigits
+from urllib.parse import urlsplit
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional
+    numpy = None
 
 from .common import *
 
@@ -18,6 +28,7 @@ class SettingTXT:
 
     XORKEY = 0x73B5DBFA
     LENGTH = 0x100
+    _keystream = b""
 
     def __init__(self, file=None, encrypted=True):
         if file:
@@ -56,14 +67,40 @@ class SettingTXT:
             self.set_video("PAL")
             self.set_game("EU")
 
-    def crypt(self, data):
+    @classmethod
+    def get_keystream(cls, length=LENGTH):
+        """Returns the first length bytes XORed onto setting.txt. They only depend on the position, so they're
+           generated once and cached.
+        """
+        if len(cls._keystream) < length:
+            out = bytearray()
+            xorkey = cls.XORKEY
+            for i in range(max(length, cls.LENGTH)):
+                out.append(xorkey & 0xFF)
+                xorkey = (xorkey << 1) | (xorkey >> 31)
+            cls._keystream = bytes(out)
+        return cls._keystream[:length]
+
+    @classmethod
+    def crypt(cls, data):
         """Encrypts/decrypts the setting.txt file."""
-        out = b""
-        xorkey = self.XORKEY
-        for byt in data:
-            out += bytes([byt ^ xorkey & 0xFF])
-            xorkey = (xorkey << 1) | (xorkey >> 31)
-        return out
+        keystream = cls.get_keystream(len(data))
+        return (int.from_bytes(data, "big") ^ int.from_bytes(keystream, "big")).to_bytes(len(data), "big")
+
+    @classmethod
+    def crypt_many(cls, blobs):
+        """Encrypts/decrypts many setting.txt files at once. Blobs of the same length are XORed in one go with
+           NumPy if it's available. Returns a list in the same order.
+        """
+        blobs = [bytes(blob) for blob in blobs]
+        if numpy is None or not blobs or len(set(len(blob) for blob in blobs)) != 1:
+            return [cls.crypt(blob) for blob in blobs]
+
+        length = len(blobs[0])
+        keystream = numpy.frombuffer(cls.get_keystream(length), dtype=numpy.uint8)
+        data = numpy.frombuffer(b"".join(blobs), dtype=numpy.uint8).reshape(len(blobs), length) ^ keystream
+        data = data.tobytes()
+        return [data[i:i + length] for i in range(0, len(data), length)]
 
     def get(self, key):
         """Returns the value of the key."""
@@ -72,25 +109,32 @@ class SettingTXT:
         except KeyError:
             raise KeyError("Key not found")
 
+    def _get_line_length(self, key, value):
+        """Helper function: Returns the length of a "key=value" line including the line break."""
+        return len(key.encode()) + 1 + len(value.encode()) + len(self.linebreak)
+
     def set(self, key, value):
         """Sets key to value. If the key already exists, it will be modified."""
-        # File length + key length + = + value length + line break length
-        if self.length + len(key) + 1 + len(value) + len(self.linebreak) > self.LENGTH:
+        key = key.upper()
+        length = self.length + self._get_line_length(key, value)
+        if self.key_exist(key):
+            length -= self._get_line_length(key, self.keys[key])
+        if length > self.LENGTH:
             raise ValueError("Maximum file size exceeded.")
 
         if not self.key_exist(key):
             self.totalKeys += 1
-        self.keys[key.upper()] = value
-        self.length = len(self.pack(encrypt=False))
+        self.keys[key] = value
+        self.length = length
 
     def delete(self, key):
         """Deletes a key."""
         if not self.key_exist(key):
             raise LookupError("Key not found.")
 
+        self.length -= self._get_line_length(key.upper(), self.keys[key.upper()])
         del (self.keys[key.upper()])
         self.totalKeys -= 1
-        self.length = len(self.pack(encrypt=False))
 
     def key_exist(self, key):
         """Returns True if the key exists."""
@@ -162,14 +206,54 @@ class SettingTXT:
 
     def pack(self, encrypt=True):
         """Helper function which packs the Struct into a bytes object."""
-        out = b""
-        for key, value in self.keys.items():
-            out += key.encode() + b"=" + value.encode() + self.linebreak
+        out = self._join(self.keys, self.linebreak)
         if encrypt:
             out = self.crypt(out)
             out += b"\x00" * (self.LENGTH - len(out))  # Fill the rest with zeroes up until LENGTH
         return out
 
+    @staticmethod
+    def _join(keys, linebreak):
+        """Helper function: Returns the "key=value" lines of keys."""
+        return b"".join(key.encode() + b"=" + value.encode() + linebreak for key, value in keys.items())
+
+    @classmethod
+    def _provision_chunk(cls, keys, linebreak, filename_format, start, rows):
+        """Helper function: Writes the encrypted files for rows, which start at index start. Returns the filenames."""
+        filenames = []
+        for index, overrides in enumerate(rows, start):
+            final = dict(keys)
+            for key, value in overrides.items():
+                final[key.upper()] = value
+            out = cls._join(final, linebreak)
+            if len(out) > cls.LENGTH:
+                raise ValueError("Row {0}: Maximum file size exceeded ({1} > {2} bytes).".format(
+                    index, len(out), cls.LENGTH
+                ))
+
+            filename = filename_format.format(index=index, **final)
+            with open(filename, "wb") as file:
+                file.write(cls.crypt(out) + b"\x00" * (cls.LENGTH - len(out)))
+            filenames.append(filename)
+        return filenames
+
+    @classmethod
+    def provision(cls, template, overrides, filename_format, workers=None, chunksize=256):
+        """Generates encrypted setting.txt files for many consoles from a template. Rows are processed in chunks
+           by a process pool and read lazily from overrides, so it can be an endless stream.
+           Yields the filenames in the order of the rows.
+
+        Args:
+            template (SettingTXT): Base file whose keys are used for every console
+            overrides (iterable): Dicts with the keys to change per console, e.g. {"SERNO": "...", "CODE": "..."}
+            filename_format (str): Format string for the output files, gets the final keys and the row `index`,
+                                   e.g. "out/{SERNO}.txt"
+            workers (int[optional]): Number of processes. Defaults to the number of CPUs, 1 disables the pool
+            chunksize (int): Number of rows per task
+        """
+        args = (dict(template.keys), template.linebreak, str(filename_format))
+        return process_chunks(cls._provision_chunk, args, overrides, workers, chunksize)
+
     def dump(self, filename, encrypt=True):
         """Dumps setting.txt to filename. Returns the filename. Optionally decrypts."""
         with open(str(filename), "wb") as file:
@@ -193,10 +277,11 @@ class NWC24dl(BigEndianStructure):
        Args:
            file (str[optional]): Path to a file
     """
-    # TODO: Search records and entries
-    # TODO: Add entries
-
     MAGIC = b"WcDl"
+    INDEXES = ["titleid", "id4", "type", "host"]
+    _index = None
+    _index_snapshot = None
+    _free_slots = None
 
     class WC24Record(BigEndianStructure):
         _pack_ = 1
@@ -392,16 +477,342 @@ class NWC24dl(BigEndianStructure):
 
     def get_used_entries(self):
         """Returns the number of used entry slots."""
-        used_entries = 0
-        for entry in self.entries:
-            if not entry.is_empty():
-                used_entries += 1
-        return used_entries
+        return count_used_slots(self._get_raw_entries(), sizeof(self.WC24Entry), NWC24dl.WC24Entry.type.offset,
+                                b"\xFF")
+
+    def _get_raw_entries(self):
+        """Helper function: Returns a memoryview of the raw entry array."""
+        return memoryview(self).cast("B")[NWC24dl.entries.offset:NWC24dl.entries.offset + NWC24dl.entries.size]
+
+    def _clear_caches(self):
+        """Helper function: Forgets everything derived from the raw entry array."""
+        self._index = None
+        self._free_slots = None
+
+    def _get_keys(self, raw, slot):
+        """Helper function: Returns the index keys (raw Title ID, raw ID4, type and URL host) of a slot."""
+        entry = raw[slot * sizeof(self.WC24Entry):(slot + 1) * sizeof(self.WC24Entry)]
+        url = entry[NWC24dl.WC24Entry.url.offset:NWC24dl.WC24Entry.url.offset + NWC24dl.WC24Entry.url.size]
+        try:
+            host = urlsplit(url.tobytes().rstrip(b"\x00").decode(errors="replace")).hostname or ""
+        except ValueError:
+            host = ""
+        return {
+            "titleid": entry[NWC24dl.WC24Entry.titleid.offset:NWC24dl.WC24Entry.groupId.offset].tobytes(),
+            "id4": entry[NWC24dl.WC24Entry.id.offset:NWC24dl.WC24Entry.titleid.offset].tobytes(),
+            "type": entry[NWC24dl.WC24Entry.type.offset],
+            "host": host
+        }
+
+    def _get_index(self):
+        """Helper function: Returns a dict of index name -> (key -> slots) for all used slots. It's built once from
+           the raw entry array and rebuilt if the entries were changed directly.
+        """
+        raw = self._get_raw_entries()
+        if self._index is None or raw.tobytes() != self._index_snapshot:
+            self._index = {name: {} for name in self.INDEXES}
+            self._index_snapshot = bytearray(raw)
+            for slot in range(len(self.entries)):
+                if raw[slot * sizeof(self.WC24Entry) + NWC24dl.WC24Entry.type.offset] == 255:
+                    continue
+                for name, key in self._get_keys(raw, slot).items():
+                    self._index[name].setdefault(key, []).append(slot)
+        return self._index
+
+    def find(self, titleid=None, id4=None, type=None, host=None, return_index=False):
+        """Finds all used entries that match every given criterion, using indexes that are built once from the
+           raw entry array. The record of an entry has the same index.
+
+        Args:
+            titleid (str): Long Title ID (16 characters)
+            id4 (str): ID4
+            type (int): Entry type (e.g. 3 for title downloads)
+            host (str): Host of the entry URL
+            return_index (bool): Return indexes instead of WC24Entry classes
+
+        Returns:
+            list: Matching entries (or indexes) in slot order
+        """
+        criteria = []
+        if titleid is not None:
+            if len(titleid) != 16:
+                raise ValueError("Title ID must be 16 characters long.")
+            criteria.append(("titleid", unhexlify(titleid.encode())))
+        if id4 is not None:
+            if len(id4) != 4:
+                raise ValueError("ID4 must be 4 characters long.")
+            criteria.append(("id4", id4.upper().encode()))
+        if type is not None:
+            criteria.append(("type", type))
+        if host is not None:
+            criteria.append(("host", host.lower()))
+
+        index = self._get_index()
+        if criteria:
+            candidates = sorted((index[name].get(key, []) for name, key in criteria), key=len)
+            slots = list(candidates[0])
+            for candidate in candidates[1:]:
+                candidate = set(candidate)
+                slots = [slot for slot in slots if slot in candidate]
+        else:
+            slots = sorted(slot for slots in index["type"].values() for slot in slots)
+
+        if return_index:
+            return slots
+        else:
+            return [self.entries[slot] for slot in slots]
 
     def get_free_entries(self):
         """Returns the number of free entry slots."""
         return self.maxEntries - self.get_used_entries()
 
+    def _is_free(self, slot):
+        """Helper function: Returns True if the entry type of a slot in the raw entry array is 255."""
+        return self._get_raw_entries()[slot * sizeof(self.WC24Entry) + NWC24dl.WC24Entry.type.offset] == 255
+
+    def _get_free_slots(self):
+        """Helper function: Returns the free-lists of reserved (below reservedEntries) and normal slots (up to
+           maxEntries). The lowest slots are at the end of the lists, so they're allocated first.
+        """
+        if self._free_slots is None:
+            limit = min(self.maxEntries, len(self.entries))
+            reserved = min(self.reservedEntries, limit)
+            self._free_slots = (
+                [slot for slot in reversed(range(reserved)) if self._is_free(slot)],
+                [slot for slot in reversed(range(reserved, limit)) if self._is_free(slot)]
+            )
+        return self._free_slots
+
+    def _update_slot(self, slot, added):
+        """Helper function: Updates the indexes and their snapshot after a slot was changed."""
+        if self._index is None:
+            return
+        raw = self._get_raw_entries()
+        start = slot * sizeof(self.WC24Entry)
+        for name, key in self._get_keys(memoryview(self._index_snapshot), slot).items():
+            slots = self._index[name].get(key)
+            if slots and slot in slots:
+                slots.remove(slot)
+                if not slots:
+                    del self._index[name][key]
+        if added:
+            for name, key in self._get_keys(raw, slot).items():
+                bisect.insort(self._index[name].setdefault(key, []), slot)
+        self._index_snapshot[start:start + sizeof(self.WC24Entry)] = raw[start:start + sizeof(self.WC24Entry)]
+
+    def add_entry(self, titleid, url, type=3, filename="", frequency=1440, dl_left=32767, id4=None,
+                  next_download=None, reserved=False):
+        """Adds an entry and its record to the first free slot of the free-list. Slots below reservedEntries are
+           only used if reserved is True, slots from maxEntries on are never used.
+
+        Args:
+            titleid (str): Long Title ID (16 characters)
+            url (str): URL to download from
+            type (int): Entry type (e.g. 3 for title downloads)
+            filename (str): File name to save the download as
+            frequency (int): Minutes between downloads
+            dl_left (int): Number of downloads until the entry is removed
+            id4 (str): ID4, defaults to the lower Title ID
+            next_download (datetime or int): First download (datetime or minutes since 1970), defaults to now
+            reserved (bool): Use the reserved slots
+
+        Returns:
+            int: Index of the new entry
+        """
+        if len(titleid) != 16:
+            raise ValueError("Title ID must be 16 characters long.")
+        titleid = int(titleid, 16)
+        if id4 is None:
+            id4 = titleid & 0xFFFFFFFF
+        elif len(id4) != 4:
+            raise ValueError("ID4 must be 4 characters long.")
+        else:
+            id4 = int(hexlify(id4.upper().encode()), 16)
+        if next_download is None:
+            next_download = int(time.time() // 60)
+
+        if self._index is not None:
+            self._get_index()  # Rebuild the indexes first if entries were changed directly
+        free_slots = self._get_free_slots()[0 if reserved else 1]
+        while free_slots and not self._is_free(free_slots[-1]):
+            self._clear_caches()  # Entry was added directly
+            free_slots = self._get_free_slots()[0 if reserved else 1]
+        if not free_slots:
+            raise LookupError("No free {0}entry slots.".format("reserved " if reserved else ""))
+        slot = free_slots[-1]
+
+        entry = NWC24dl.WC24Entry()
+        entry.index = slot
+        entry.type = type
+        entry.id = id4
+        entry.titleid = titleid
+        entry.frequency_days = 1440  # Same in every known entry
+        entry.set_url(url)
+        if filename:
+            entry.set_filename(filename)
+        entry.set_frequency(frequency)
+        entry.set_dl_left(dl_left)
+
+        record = NWC24dl.WC24Record()
+        record.titleid = id4
+        record.nextDl = self._to_minutes(next_download)
+
+        free_slots.pop()
+        self.entries[slot] = entry
+        self.records[slot] = record
+        self._update_slot(slot, added=True)
+        return slot
+
+    def remove_entry(self, index):
+        """Removes the entry and record at index and returns the slot to the free-list."""
+        if not 0 <= index < len(self.entries):
+            raise ValueError("Out of bounds.")
+        if self._is_free(index):
+            raise LookupError("No entry on this index.")
+
+        if self._index is not None:
+            self._get_index()  # Rebuild the indexes first if entries were changed directly
+        entry = NWC24dl.WC24Entry()
+        entry.type = 255
+        self.entries[index] = entry
+        self.records[index] = NWC24dl.WC24Record()
+
+        if self._free_slots is not None and index < min(self.maxEntries, len(self.entries)):
+            self._free_slots[0 if index < self.reservedEntries else 1].append(index)
+        self._update_slot(index, added=False)
+
+    @staticmethod
+    def _to_minutes(value):
+        """Helper function: Converts a datetime to minutes since 1970 (the unit of nextDl). Ints are returned as-is."""
+        if isinstance(value, datetime):
+            return int((value - datetime(1970, 1, 1)).total_seconds() // 60)
+        return value
+
+    def get_tasks(self, start):
+        """Returns the download tasks of all used entries, read from the raw buffers. If nextDl isn't set, the first
+           download is projected from the last successful one (dlTimestamp + frequency), or done at start if the
+           entry was never downloaded. Overdue downloads (before start) are done at start.
+
+        Args:
+            start (datetime or int): Start of the simulation (datetime or minutes since 1970)
+
+        Returns:
+            list: Tuples of (first download in minutes since 1970, frequency in minutes, downloads left, index)
+        """
+        start = self._to_minutes(start)
+        raw = memoryview(self).cast("B")
+        tasks = []
+        for index in range(len(self.entries)):
+            entry = NWC24dl.entries.offset + index * sizeof(self.WC24Entry)
+            if raw[entry + NWC24dl.WC24Entry.type.offset] == 255:
+                continue
+            next_dl, = struct.unpack_from(">I", raw, NWC24dl.records.offset + index * sizeof(self.WC24Record) +
+                                          NWC24dl.WC24Record.nextDl.offset)
+            dl_left, = struct.unpack_from(">H", raw, entry + NWC24dl.WC24Entry.dlLeft.offset)
+            frequency, = struct.unpack_from(">H", raw, entry + NWC24dl.WC24Entry.frequency.offset)
+            if next_dl == 0:
+                dl_timestamp, = struct.unpack_from(">I", raw, entry + NWC24dl.WC24Entry.dlTimestamp.offset)
+                if dl_timestamp:
+                    next_dl = dl_timestamp + frequency
+            if dl_left:
+                tasks.append((max(next_dl, start), frequency, dl_left, index))
+        return tasks
+
+    @staticmethod
+    def _run_schedule(heap, end):
+        """Helper function: Pops downloads from a heap of (minute, *ids, frequency, downloads left) until end.
+           Yields (minute, *ids).
+        """
+        heapq.heapify(heap)
+        while heap:
+            task = heap[0]
+            yield task[:-2]
+            if task[-1] > 1 and task[-2] and task[0] + task[-2] < end:
+                heapq.heapreplace(heap, (task[0] + task[-2],) + task[1:-1] + (task[-1] - 1,))
+            else:
+                heapq.heappop(heap)
+
+    def get_schedule(self, start, end):
+        """Projects the downloads of all used entries from start until (excluding) end with a priority queue.
+           Entries are downloaded every `frequency` minutes until `dlLeft` downloads are done (only once if the
+           frequency is 0).
+
+        Args:
+            start (datetime or int): Start of the simulation (datetime or minutes since 1970)
+            end (datetime or int): End of the simulation (datetime or minutes since 1970)
+
+        Returns:
+            generator: (minutes since 1970, entry index) tuples in chronological order
+        """
+        end = self._to_minutes(end)
+        heap = [(minute, index, frequency, dl_left) for minute, frequency, dl_left, index in self.get_tasks(start)
+                if minute < end]
+        return self._run_schedule(heap, end)
+
+    @staticmethod
+    def simulate(files, start, end):
+        """Merges the download schedules of many consoles (see get_schedule) in one priority queue.
+
+        Args:
+            files (list): NWC24dl objects or paths to nwc24dl.bin files
+            start (datetime or int): Start of the simulation (datetime or minutes since 1970)
+            end (datetime or int): End of the simulation (datetime or minutes since 1970)
+
+        Returns:
+            generator: (minutes since 1970, file index, entry index) tuples in chronological order
+        """
+        end = NWC24dl._to_minutes(end)
+        heap = []
+        for number, file in enumerate(files):
+            if not isinstance(file, NWC24dl):
+                file = NWC24dl(file)
+            for minute, frequency, dl_left, index in file.get_tasks(start):
+                if minute < end:
+                    heap.append((minute, number, index, frequency, dl_left))
+        return NWC24dl._run_schedule(heap, end)
+
+    @staticmethod
+    def get_load_histogram(files, start, end):
+        """Returns the number of downloads per minute of many consoles from start until (excluding) end. Counts
+           are added per entry with strided slices instead of simulating every download.
+
+        Args:
+            files (list): NWC24dl objects or paths to nwc24dl.bin files
+            start (datetime or int): Start of the simulation (datetime or minutes since 1970)
+            end (datetime or int): End of the simulation (datetime or minutes since 1970)
+
+        Returns:
+            list: Downloads per minute, the first item is start
+        """
+        start, end = NWC24dl._to_minutes(start), NWC24dl._to_minutes(end)
+        length = max(end - start, 0)
+        if numpy is not None:
+            histogram = numpy.zeros(length, dtype=numpy.uint64)
+        else:
+            histogram = [0] * length
+
+        runs = {}  # Identical download series of different consoles are added together
+        for file in files:
+            if not isinstance(file, NWC24dl):
+                file = NWC24dl(file)
+            for minute, frequency, dl_left, index in file.get_tasks(start):
+                first = minute - start
+                if first >= length:
+                    continue
+                run = (first, frequency, min(length, first + dl_left * frequency) if frequency else first + 1)
+                runs[run] = runs.get(run, 0) + 1
+
+        for (first, frequency, last), count in runs.items():
+            if numpy is not None:
+                histogram[first:last:frequency or 1] += count
+            else:
+                for offset in range(first, last, frequency or 1):
+                    histogram[offset] += count
+
+        if numpy is not None:
+            return histogram.tolist()
+        return histogram
+
     def __init__(self, file=None):
         if not file:
             self.magic = self.MAGIC
@@ -443,6 +854,8 @@ class NWC24fl(BigEndianStructure):
     """
 
     MAGIC = b"WcFl"
+    _index = None
+    _index_snapshot = None
 
     class FriendListEntry(BigEndianStructure):
         _pack_ = 1
@@ -467,7 +880,7 @@ class NWC24fl(BigEndianStructure):
             if self.type == 0:  # None
                 return None
             elif self.type == 1:  # Wii friend
-                return int.from_bytes(bytes(self.friendCode).rstrip(b"\00"), byteorder='big')
+                return int.from_bytes(bytes(self.friendCode)[:8], byteorder='big')
             elif self.type == 2:  # E-Mail
                 return bytes(self.friendCode).rstrip(b"\x00").decode()
             else:
@@ -497,6 +910,121 @@ class NWC24fl(BigEndianStructure):
         ("friendList", ARRAY(FriendListEntry, 100))
     ]
 
+    def _get_raw_friends(self):
+        """Helper function: Returns a memoryview of the raw friend list."""
+        return memoryview(self).cast("B")[NWC24fl.friendList.offset:NWC24fl.friendList.offset + NWC24fl.friendList.size]
+
+    def _get_index(self):
+        """Helper function: Returns a dict of index name -> (key -> slots) for all used slots. It's built in one
+           pass over the raw friend list and rebuilt if the entries were changed.
+        """
+        raw = self._get_raw_friends()
+        if self._index is None or raw.tobytes() != self._index_snapshot:
+            self._index = {"friend_code": {}, "email": {}, "name": {}}
+            self._index_snapshot = raw.tobytes()
+            size = sizeof(self.FriendListEntry)
+            for slot in range(len(self.friendList)):
+                start = slot * size
+                friend_type, = struct.unpack_from(">I", raw, start + NWC24fl.FriendListEntry.type.offset)
+                if friend_type == 0:
+                    continue
+                code = start + NWC24fl.FriendListEntry.friendCode.offset
+                if friend_type == 1:
+                    self._index["friend_code"].setdefault(struct.unpack_from(">Q", raw, code)[0], []).append(slot)
+                elif friend_type == 2:
+                    email = raw[code:code + NWC24fl.FriendListEntry.friendCode.size].tobytes().rstrip(b"\x00")
+                    self._index["email"].setdefault(email.decode(errors="replace").lower(), []).append(slot)
+                name = start + NWC24fl.FriendListEntry.name.offset
+                name = raw[name:name + NWC24fl.FriendListEntry.name.size].tobytes().rstrip(b"\x00")
+                self._index["name"].setdefault(name.decode("utf-16-be", errors="replace"), []).append(slot)
+        return self._index
+
+    def find(self, friend_code=None, email=None, name=None, return_index=False):
+        """Finds all friends that match every given criterion, using indexes that are built in one pass over the
+           raw friend list.
+
+        Args:
+            friend_code (int): Wii friend code
+            email (str): E-Mail address (case-insensitive)
+            name (str): Name of the friend
+            return_index (bool): Return indexes instead of FriendListEntry classes
+
+        Returns:
+            list: Matching friends (or indexes) in slot order
+        """
+        criteria = []
+        if friend_code is not None:
+            criteria.append(("friend_code", int(friend_code)))
+        if email is not None:
+            criteria.append(("email", email.lower()))
+        if name is not None:
+            criteria.append(("name", name))
+
+        index = self._get_index()
+        if criteria:
+            candidates = sorted((index[name].get(key, []) for name, key in criteria), key=len)
+            slots = list(candidates[0])
+            for candidate in candidates[1:]:
+                candidate = set(candidate)
+                slots = [slot for slot in slots if slot in candidate]
+        else:
+            slots = sorted(slot for slots in index["name"].values() for slot in slots)
+
+        if return_index:
+            return slots
+        else:
+            return [self.friendList[slot] for slot in slots]
+
+    def get_friends(self):
+        """Returns a dict of friend code -> status (as int) of all Wii friends."""
+        raw = self._get_raw_friends()
+        friends = {}
+        for friend_code, slots in self._get_index()["friend_code"].items():
+            friends[friend_code], = struct.unpack_from(
+                ">I", raw, slots[0] * sizeof(self.FriendListEntry) + NWC24fl.FriendListEntry.status.offset
+            )
+        return friends
+
+    @staticmethod
+    def get_friendship_graph(friend_lists):
+        """Builds the friendship graph of many consoles.
+
+        Args:
+            friend_lists (dict): Friend code of a console -> its NWC24fl object or path to its nwc24fl.bin
+
+        Returns:
+            dict: Friend code -> dict of friend code -> status (as int) of the Wii friends in its list
+        """
+        graph = {}
+        for friend_code, friend_list in friend_lists.items():
+            if not isinstance(friend_list, NWC24fl):
+                friend_list = NWC24fl(friend_list)
+            graph[int(friend_code)] = friend_list.get_friends()
+        return graph
+
+    @staticmethod
+    def get_mutual_friends(graph, confirmed=None):
+        """Returns the pairs of consoles in a friendship graph that have each other in their friend lists, in
+           linear time (one lookup per edge).
+
+        Args:
+            graph (dict): Friendship graph (see get_friendship_graph)
+            confirmed (bool): Only pairs that are confirmed on both sides (True) or not confirmed on one side
+                              (False), all pairs if None
+
+        Returns:
+            list: Sorted (friend code, friend code) tuples, the smaller one first
+        """
+        pairs = []
+        for friend_code, friends in graph.items():
+            for other, status in friends.items():
+                if other <= friend_code or friend_code not in graph.get(other, {}):
+                    continue
+                both_confirmed = status == 2 and graph[other][friend_code] == 2
+                if confirmed is None or confirmed == both_confirmed:
+                    pairs.append((friend_code, other))
+        return sorted(pairs)
+
     def __repr__(self):
         return "Wii Friend List: {0}/{1} Entries used".format(self.friendCount, self.maxEntries)
 
@@ -581,30 +1109,21 @@ class NWC24msg(BigEndianStructure):
         if len(domain) > 64:
             raise ValueError("Domain must be <= 64 characters.")
 
-        domain = pad_to_cbyte_array(domain.encode(), 64)
-        self.mailDomain = domain
-
-        self.update_checksum()
+        self._set_field("mailDomain", pad_to_cbyte_array(domain.encode(), 64))
 
     def set_password(self, password):
         """Changes Wii Mail password. Also updates the checksum."""
         if len(password) > 32:
             raise ValueError("Password must be <= 32 characters.")
 
-        password = pad_to_cbyte_array(password.encode(), 32)
-        self.passwd = password
-
-        self.update_checksum()
+        self._set_field("passwd", pad_to_cbyte_array(password.encode(), 32))
 
     def set_mlchkid(self, mlchkid):
         """Changes Wii Mail Check ID. Also updates the checksum."""
         if len(mlchkid) > 36:
             raise ValueError("Mail Check ID must be <= 36 characters.")
 
-        mlchkid = pad_to_cbyte_array(mlchkid.encode(), 36)
-        self.mlchkid = mlchkid
-
-        self.update_checksum()
+        self._set_field("mlchkid", pad_to_cbyte_array(mlchkid.encode(), 36))
 
     def set_engine_url(self, num, url):
         """Changes the URLs used by the Mail Engine. Also updates the checksum.
@@ -624,17 +1143,32 @@ class NWC24msg(BigEndianStructure):
         if len(url) > 128:
             raise ValueError("URL must be <= 128 characters.")
 
-        url = pad_to_cbyte_array(url.encode(), 128)
-        self.mailEngineURLs[num] = url
+        self._set_field("mailEngineURLs", pad_to_cbyte_array(url.encode(), 128), num)
 
-        self.update_checksum()
+    def _set_field(self, name, value, index=None):
+        """Helper function: Sets field name (or its element index) to value and updates the checksum by the
+           difference between the old and new bytes instead of summing up the whole Struct again.
+        """
+        start, size = getattr(NWC24msg, name).offset, getattr(NWC24msg, name).size
+        if index is not None:
+            size //= len(getattr(self, name))
+            start += index * size
+        view = memoryview(self).cast("B")[start:start + size]
+        old = bytes(view)
+        if index is None:
+            setattr(self, name, value)
+        else:
+            getattr(self, name)[index] = value
+        self.checksum = Crypto.update_checksum(self.checksum, old, view)
 
     def generate_checksum(self):
         """Generates the checksum."""
-        return Crypto.generate_checksum(self.pack()[:-4])
+        return Crypto.generate_checksum(memoryview(self).cast("B")[:NWC24msg.checksum.offset])
 
     def update_checksum(self):
-        """Updates the checksum in the Struct."""
+        """Updates the checksum in the Struct. Only needed after fields were changed directly, the setters
+           update it by themselves.
+        """
         self.checksum = self.generate_checksum()
 
     def __repr__(self):
@@ -1096,6 +1630,23 @@ class NetConfig(BigEndianStructure):
             self.proxy.password = pad_to_cbyte_array(password.encode(), 32)
             self.proxyCopy.password = pad_to_cbyte_array(password.encode(), 32)
 
+    # Field name -> setter, its keyword arguments and the members it writes (besides the flags)
+    PROVISIONING_FIELDS = {
+        "ssid": ("set_ssid", {}, ["ssid", "ssidLength"]),
+        "key": ("set_key", {}, ["encryption", "keyLength", "wepKeyInHex", "key"]),
+        "ip": ("set_ip", {}, ["ip"]),
+        "netmask": ("set_netmask", {}, ["netmask"]),
+        "gateway": ("set_gateway", {}, ["gateway"]),
+        "primary_dns": ("set_dns", {"primary": True}, ["primaryDNS"]),
+        "secondary_dns": ("set_dns", {"primary": False}, ["secondaryDNS"]),
+        "mtu": ("set_mtu", {}, ["mtu"]),
+        "proxy": ("set_proxy", {}, ["proxy.active", "proxy.server", "proxy.port",
+                                    "proxyCopy.active", "proxyCopy.server", "proxyCopy.port"]),
+        "proxy_auth": ("set_proxy_auth", {}, ["proxy.authentication", "proxy.username", "proxy.password",
+                                              "proxyCopy.authentication", "proxyCopy.username",
+                                              "proxyCopy.password"])
+    }
+
     _pack_ = 1
     _fields_ = [
         ("unknown1", ARRAY(c_byte, 4)),
@@ -1118,12 +1669,99 @@ class NetConfig(BigEndianStructure):
                 connection.flags.selected = 0
         slot.flags.selected = 1
 
+    @classmethod
+    def _compile_patch(cls, field, value):
+        """Helper function: Compiles an override into byte patches for a connection slot. The setter is called once
+           on scratch entries and the bytes of the members it writes are copied out, so the patch can be applied to
+           any slot by offset. Flags are returned as (keep mask, set mask), as several setters change them.
+
+        Returns:
+            tuple: List of (offset in the slot, bytes), keep mask and set mask of the flags byte
+        """
+        try:
+            method, kwargs, members = cls.PROVISIONING_FIELDS[field]
+        except KeyError:
+            raise ValueError("Unknown field: {0}".format(field))
+
+        args = value if isinstance(value, (tuple, list)) else (value,)
+        scratches = [cls.ConnectionEntry(), cls.ConnectionEntry()]
+        memoryview(scratches[1]).cast("B")[cls.ConnectionEntry.flags.offset] = 0xFF
+        for scratch in scratches:
+            getattr(scratch, method)(*args, **kwargs)
+
+        raw = bytes(scratches[0])
+        patches = []
+        for member in members:
+            offset = 0
+            struct_class = cls.ConnectionEntry
+            for name in member.split("."):
+                field_descriptor = getattr(struct_class, name)
+                offset += field_descriptor.offset
+                struct_class = dict(struct_class._fields_)[name]
+            patches.append((offset, raw[offset:offset + field_descriptor.size]))
+        flags = cls.ConnectionEntry.flags.offset
+        return patches, bytes(scratches[1])[flags], raw[flags]
+
+    @classmethod
+    def _provision_chunk(cls, template, slot, filename_format, start, rows):
+        """Helper function: Writes the files for rows, which start at index start. Returns the filenames."""
+        base = cls.connections.offset + slot * sizeof(cls.ConnectionEntry)
+        flags = base + cls.ConnectionEntry.flags.offset
+        compiled = {}
+        filenames = []
+        for index, overrides in enumerate(rows, start):
+            data = bytearray(template)
+            for field, value in overrides.items():
+                key = (field, tuple(value) if isinstance(value, list) else value)
+                if key not in compiled:
+                    try:
+                        compiled[key] = cls._compile_patch(field, value)
+                    except ValueError as e:
+                        raise ValueError("Row {0}: {1}".format(index, e))
+                patches, keep, set_bits = compiled[key]
+                for offset, patch in patches:
+                    data[base + offset:base + offset + len(patch)] = patch
+                data[flags] = (data[flags] & keep) | set_bits
+
+            filename = filename_format.format(index=index, **overrides)
+            with open(filename, "wb") as file:
+                file.write(data)
+            filenames.append(filename)
+        return filenames
+
+    @classmethod
+    def provision(cls, template, overrides, filename_format, slot=0, workers=None, chunksize=256):
+        """Generates config.dat files for many consoles from a template. Every override is compiled once into
+           byte patches at fixed offsets of the slot (see PROVISIONING_FIELDS), so each file is a copy of the
+           template with the patches applied. Overrides are applied in the order of their dicts, like calling the
+           setters in that order. Rows are processed in chunks by a process pool and read lazily from overrides.
+           Yields the filenames in the order of the rows.
+
+        Args:
+            template (NetConfig): Base config, e.g. with the slot already selected
+            overrides (iterable): Dicts with the fields to change per console, e.g.
+                                  {"ssid": "...", "key": ("...", "WPA2"), "ip": "...", "proxy": ("...", 8080)}
+            filename_format (str): Format string for the output files, gets the overrides and the row `index`,
+                                   e.g. "out/{index}.dat"
+            slot (int): Connection slot to change (0-2)
+            workers (int[optional]): Number of processes. Defaults to the number of CPUs, 1 disables the pool
+            chunksize (int): Number of rows per task
+        """
+        if not 0 <= slot <= 2:
+            raise ValueError("Out of bounds.")
+
+        args = (bytes(template), slot, str(filename_format))
+        return process_chunks(cls._provision_chunk, args, overrides, workers, chunksize)
+
+    def get_used_slots(self):
+        """Returns the number of used connection slots. Not cached, as slots are changed through their
+           ConnectionEntry.
+        """
+        return count_used_slots(memoryview(self).cast("B")[NetConfig.connections.offset:],
+                                sizeof(self.ConnectionEntry), NetConfig.ConnectionEntry.flags.offset, b"\x00")
+
     def __repr__(self):
-        used_slots = 0
-        for slot in self.connections:
-            if not slot.is_blank():
-                used_slots += 1
-        return "Wii Network Config ({0}/3 Slots used)".format(used_slots)
+        return "Wii Network Config ({0}/3 Slots used)".format(self.get_used_slots())
 
     def __str__(self):
         output = "Wii Network Config:\n"
@@ -1234,6 +1872,12 @@ class IplSave(BigEndianStructure):
         def __repr__(self):
             return self.get_titleid()
 
+    EMPTY = b"\x00" * 8
+    BATCH_OPERATIONS = ["move_channel", "add_disc_channel", "delete_channel", "compact"]
+    md5_outdated = False
+    _index = None
+    _index_duplicates = False
+
     _pack_ = 1
     _fields_ = [
         ("magic", ARRAY(c_char, 4)),
@@ -1246,24 +1890,131 @@ class IplSave(BigEndianStructure):
 
     def generate_md5(self):
         """Generates the md5sum."""
-        return Crypto.create_md5hash(self.pack()[:-16])
+        return Crypto.create_md5hash(memoryview(self).cast("B")[:IplSave.md5.offset])
 
     def update_md5(self):
         """Updates the md5sum in the Struct."""
         self.md5 = ARRAY(c_byte, sizeof(self.md5)).from_buffer_copy(self.generate_md5())
+        self.md5_outdated = False
+
+    def flush(self):
+        """Updates the md5sum if channels were changed since the last update."""
+        if self.md5_outdated:
+            self.update_md5()
+
+    def batch(self):
+        """Returns a Batch to queue moves, disc channel changes and deletes in a with block. They're validated
+           and applied together on commit with a single MD5 update and rolled back if one of them fails.
+        """
+        return Batch(self)
+
+    def pack(self):
+        """Packs the Struct into a bytes object. Updates the MD5 first if needed."""
+        self.flush()
+        return bytes(self)
 
     def get_used_blocks(self):
         """Returns the number of used channel slots."""
-        used_blocks = 0
-        for channel in self.channels:
-            if channel.is_used():
-                used_blocks += 1
-        return used_blocks
+        return count_used_slots(self._get_raw_channels(), sizeof(self.Channel), IplSave.Channel.type.offset, b"\x00")
 
     def get_free_blocks(self):
         """Returns the number of free channel slots."""
         return len(self.channels) - self.get_used_blocks()
 
+    def _get_raw_channels(self):
+        """Helper function: Returns a memoryview of the raw channel array (16 bytes per slot)."""
+        return memoryview(self).cast("B")[IplSave.channels.offset:IplSave.channels.offset + IplSave.channels.size]
+
+    def _get_raw_titleid(self, slot):
+        """Helper function: Returns the raw (big endian) Title ID of a slot."""
+        offset = slot * sizeof(self.Channel) + self.Channel.titleid.offset
+        return self._get_raw_channels()[offset:offset + 8].tobytes()
+
+    def _get_index(self):
+        """Helper function: Returns two dicts (raw Title ID -> slot and raw ID4 -> slot) for all slots with a
+           Title ID. They're built once from the raw channel array and kept up to date by the methods of this class.
+        """
+        if self._index is None:
+            titleids, id4s = {}, {}
+            self._index_duplicates = False
+            for slot in range(len(self.channels)):
+                titleid = self._get_raw_titleid(slot)
+                if titleid == self.EMPTY:
+                    continue
+                if titleid[4:] in id4s:  # Duplicates can't be updated incrementally, only the first one is found
+                    self._index_duplicates = True
+                titleids.setdefault(titleid, slot)
+                id4s.setdefault(titleid[4:], slot)
+            self._index = (titleids, id4s)
+        return self._index
+
+    def _clear_caches(self):
+        """Helper function: Forgets everything derived from the raw channel array."""
+        self._index = None
+
+    def _changed(self):
+        """Helper function: Marks the MD5 as outdated after channels were changed."""
+        self.md5_outdated = True
+
+    def _update_index(self, titleid, old_slot=None, new_slot=None):
+        """Helper function: Moves titleid in the index from old_slot to new_slot (None for additions/deletions)."""
+        if self._index is None or titleid == self.EMPTY:
+            return
+        if self._index_duplicates:
+            self._index = None
+            return
+        for index, key in zip(self._index, [titleid, titleid[4:]]):
+            if new_slot is not None:
+                index[key] = new_slot
+            elif index.get(key) == old_slot:
+                del index[key]
+
+    def get_occupancy(self):
+        """Returns the occupancy bitmap of the channel slots (bit n is set if slot n is used)."""
+        occupancy = 0
+        types = self._get_raw_channels()[IplSave.Channel.type.offset::sizeof(self.Channel)]
+        for slot, channel_type in enumerate(types):
+            if channel_type:
+                occupancy |= 1 << slot
+        return occupancy
+
+    def find_free_slots(self, count=1, strategy="first"):
+        """Returns the first slot of count consecutive free slots. Strategy can be "first" (first-fit) or
+           "best" (best-fit, uses the smallest gap that fits).
+        """
+        return find_free_slots(self.get_occupancy(), len(self.channels), count, strategy)
+
+    @staticmethod
+    def get_position(slot):
+        """Returns col, row and page of a slot."""
+        return slot % 4, (slot // 4) % 3, slot // 12
+
+    def compact(self):
+        """Moves all channels to the front in one pass, closing the gaps between them but keeping their order.
+           The disc channel stays where it is.
+        """
+        try:
+            disc = self.get_disc_channel_index()
+        except LookupError:
+            disc = None
+
+        size = sizeof(self.Channel)
+        raw = self._get_raw_channels()
+        compacted = bytearray(len(raw))
+        if disc is not None:
+            compacted[disc * size:(disc + 1) * size] = raw[disc * size:(disc + 1) * size]
+        slot = 0
+        for i in range(len(self.channels)):
+            if i == disc or not raw[i * size + IplSave.Channel.type.offset]:
+                continue
+            if slot == disc:
+                slot += 1
+            compacted[slot * size:(slot + 1) * size] = raw[i * size:(i + 1) * size]
+            slot += 1
+        raw[:] = compacted
+        self._clear_caches()
+        self._changed()
+
     def _get_channel_by_id4_or_tid(self, search, by_titleid=False, return_index=False):
         """Helper function for get_channel_by_id4 and get_channel_by_titleid.
 
@@ -1275,24 +2026,31 @@ class IplSave(BigEndianStructure):
         if by_titleid:
             if len(search) != 16:
                 raise ValueError("Title ID must be 16 characters long.")
+            try:
+                key = unhexlify(search.encode())
+            except ValueError:
+                raise LookupError("Channel not found.")
         else:
             if len(search) != 4:
                 raise ValueError("ID4 must be 4 characters long.")
+            key = search.upper().encode()
 
-        for i, channel in enumerate(self.channels):
-            if by_titleid:
-                if channel.get_titleid() == search.lower():
-                    if return_index:
-                        return i
-                    else:
-                        return channel
-            else:
-                if channel.get_id4() == search.upper():
-                    if return_index:
-                        return i
-                    else:
-                        return channel
-        raise LookupError("Channel not found.")
+        if key == self.EMPTY:  # Free slots and the disc channel have no Title ID
+            slot = next((i for i, channel in enumerate(self.channels) if channel.titleid == 0), None)
+            if slot is None:
+                raise LookupError("Channel not found.")
+        else:
+            slot = self._get_index()[0 if by_titleid else 1].get(key)
+            if slot is None or not self._get_raw_titleid(slot).endswith(key):
+                self._index = None  # Channel may have been changed directly, rescan before giving up
+                slot = self._get_index()[0 if by_titleid else 1].get(key)
+            if slot is None:
+                raise LookupError("Channel not found.")
+
+        if return_index:
+            return slot
+        else:
+            return self.channels[slot]
 
     def get_channel_by_id4(self, id4):
         """Finds a channel by its ID4."""
@@ -1339,7 +2097,22 @@ class IplSave(BigEndianStructure):
 
         self.channels[new_position] = self.channels[old_position]
         old_channel.delete()
-        self.update_md5()
+        self._update_index(self._get_raw_titleid(new_position), old_position, new_position)
+        self._changed()
+
+    def delete_channel(self, col, row, page):
+        """Deletes the channel at col, row on page. Note that the Wii will re-populate it."""
+        if not 0 <= col <= 3 or not 0 <= row <= 2 or not 0 <= page <= 3:
+            raise ValueError("Out of bounds.")
+
+        position = (col + (row * 4) + (page * 12))
+        if not self.channels[position].is_used():
+            raise LookupError("No channel on this position.")
+
+        titleid = self._get_raw_titleid(position)
+        self.channels[position].delete()
+        self._update_index(titleid, old_slot=position)
+        self._changed()
 
     def add_disc_channel(self, col=0, row=0, page=0):
         """Adds/Moves disc channel to col, row on page. Defaults to first slot."""
@@ -1366,7 +2139,7 @@ class IplSave(BigEndianStructure):
             new_channel.flags = 15
             new_channel.titleid = 0
 
-        self.update_md5()
+        self._changed()
 
     def __repr__(self):
         return "Wii IplSave: {0} slot{1} used out of 48 ({2} free)".format(
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+import array
+import hashlib
+import json
+import os
+import sys
+from binascii import hexlify, unhexlify
+
+from .common import *
+from .export import Savegame
+
+
+def _write_atomic(path, data):
+    """Helper function: Writes data to a temporary file first and moves it to path, so readers never see
+       partially written files.
+    """
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder, exist_ok=True)
+    tmp = "{0}.{1}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as file:
+        file.write(data)
+    os.replace(tmp, path)
+
+
+class SavegameStore:
+    """Content-addressed store for savegames. Every decrypted file payload is stored only once on disk, keyed by
+       its SHA-256 hash, so identical files of different savegames (e.g. from different consoles) share their data.
+       Savegames are recorded as small manifests that reference those objects and can be rebuilt byte-identically.
+
+       Objects are spread over 256 subdirectories named after the first two hex digits of their hash.
+
+       Args:
+           directory (str): Path to the store (will be created if it doesn't exist)
+    """
+
+    OBJECTS = "objects"
+    MANIFESTS = "manifests"
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        for folder in [self.OBJECTS, self.MANIFESTS]:
+            if not os.path.isdir(os.path.join(self.directory, folder)):
+                os.makedirs(os.path.join(self.directory, folder))
+
+    def _get_object_path(self, digest):
+        """Helper function: Returns the path to the object with the given SHA-256 hex digest."""
+        return os.path.join(self.directory, self.OBJECTS, digest[:2], digest[2:])
+
+    def _get_manifest_path(self, manifest_id):
+        """Helper function: Returns the path to the manifest with the given ID."""
+        return os.path.join(self.directory, self.MANIFESTS, "{0}.json".format(manifest_id))
+
+    def put_object(self, data):
+        """Stores data if it isn't already in the store. Returns its SHA-256 hex digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._get_object_path(digest)
+        if not os.path.isfile(path):
+            _write_atomic(path, data)
+        return digest
+
+    def get_object(self, digest):
+        """Returns the data of an object."""
+        try:
+            with open(self._get_object_path(digest), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            raise LookupError("Object {0} not found.".format(digest))
+
+    def has_object(self, digest):
+        """Returns True if the object is in the store."""
+        return os.path.isfile(self._get_object_path(digest))
+
+    def ingest(self, savegame):
+        """Adds a Savegame object to the store. Returns the ID of its manifest."""
+        manifest = {
+            "header": self.put_object(savegame.header.pack(encrypt=False)),
+            "bkHeader": hexlify(savegame.bkHeader.pack()).decode(),
+            "files": [],
+            "certificates": self.put_object(savegame.certificates)
+        }
+        for file in savegame.files:
+            manifest["files"].append({
+                "header": hexlify(file.header.pack()).decode(),
+                "data": self.put_object(file.data)
+            })
+
+        manifest = json.dumps(manifest, sort_keys=True, separators=(",", ":")).encode()
+        manifest_id = hashlib.sha256(manifest).hexdigest()
+        path = self._get_manifest_path(manifest_id)
+        if not os.path.isfile(path):
+            _write_atomic(path, manifest)
+        return manifest_id
+
+    def get_manifest(self, manifest_id):
+        """Returns the manifest as a dict."""
+        try:
+            with open(self._get_manifest_path(manifest_id), "rb") as file:
+                return json.loads(file.read().decode())
+        except FileNotFoundError:
+            raise LookupError("Manifest {0} not found.".format(manifest_id))
+
+    def get_manifests(self):
+        """Returns the IDs of all manifests in the store."""
+        manifests = []
+        for filename in sorted(os.listdir(os.path.join(self.directory, self.MANIFESTS))):
+            if filename.endswith(".json"):
+                manifests.append(filename[:-5])
+        return manifests
+
+    def rebuild(self, manifest_id, filename):
+        """Rebuilds the encrypted data.bin of a manifest to filename. Returns the filename."""
+        manifest = self.get_manifest(manifest_id)
+        with open(str(filename), "wb") as file:
+            file.write(Crypto.encrypt_data(SDKEY, SDIV, self.get_object(manifest["header"])))
+            file.write(unhexlify(manifest["bkHeader"]))
+            for file_entry in manifest["files"]:
+                fileheader = unhexlify(file_entry["header"])
+                file.write(fileheader)
+                iv = fileheader[0x050:0x050 + 16]  # IV is always at 0x050 in the file header
+                path = self._get_object_path(file_entry["data"])
+                if not os.path.isfile(path):
+                    raise LookupError("Object {0} not found.".format(file_entry["data"]))
+                with open(path, "rb") as src:
+                    Crypto.encrypt_stream(SDKEY, iv, src, file, os.path.getsize(path))
+            file.write(self.get_object(manifest["certificates"]))
+            return file.name
+
+    def get_size(self):
+        """Returns the number of bytes used by objects and manifests on disk."""
+        size = 0
+        for root, dirs, files in os.walk(self.directory):
+            for filename in files:
+                size += os.path.getsize(os.path.join(root, filename))
+        return size
+
+    def __repr__(self):
+        return "Savegame Store at {0} ({1} manifest{2})".format(
+            self.directory,
+            len(self.get_manifests()),
+            "" if len(self.get_manifests()) == 1 else "s"
+        )
+
+
+class SavegameHistory:
+    """Stores the version history of savegames, keyed by Game ID and console (NG ID). Every version is stored as a
+       block-level binary delta to the previous one, with a full snapshot every `keyframe_interval` versions to
+       keep reconstruction fast. The latest version is kept as "head", so appending only writes the changed blocks.
+
+       Versions are stored decrypted (like Savegame.pack(encrypt=False)) and re-encrypted when dumped.
+
+       Args:
+           directory (str): Path to the history (will be created if it doesn't exist)
+           blocksize (int): Size of the blocks that are compared
+           keyframe_interval (int): Store a full snapshot every n versions
+    """
+
+    DELTAMAGIC = b"WDlt"
+
+    class DeltaHeader(BigEndianStructure):
+        _pack_ = 1
+        _fields_ = [
+            ("magic", ARRAY(c_char, 4)),
+            ("blockSize", c_uint32),
+            ("length", c_uint32),
+            ("blockCount", c_uint32)
+        ]
+
+    def __init__(self, directory, blocksize=0x400, keyframe_interval=32):
+        self.directory = str(directory)
+        self.blocksize = blocksize
+        self.keyframe_interval = keyframe_interval
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _get_path(self, gameid, ngid, filename=""):
+        """Helper function: Returns the path to the history of a savegame or a file in it."""
+        return os.path.join(self.directory, "{0}-{1:08x}".format(gameid, ngid), filename)
+
+    def _get_index(self, gameid, ngid):
+        """Helper function: Returns the index with the sizes of every version and the version stored as head."""
+        try:
+            with open(self._get_path(gameid, ngid, "index.json"), "rb") as file:
+                index = json.loads(file.read().decode())
+        except FileNotFoundError:
+            return {"sizes": [], "head": None}
+        index.setdefault("head", len(index["sizes"]) - 1)
+        return index
+
+    def _write_index(self, gameid, ngid, index):
+        """Helper function: Writes the index."""
+        _write_atomic(self._get_path(gameid, ngid, "index.json"), json.dumps(index).encode())
+
+    def _get_changed_blocks(self, old, new):
+        """Helper function: Returns the indexes of all blocks of new that differ from old."""
+        indexes = array.array("I")
+        window = self.blocksize * 16
+        for start in range(0, len(new), window):
+            if new[start:start + window] == old[start:start + window]:
+                continue
+            for block in range(start, min(start + window, len(new)), self.blocksize):
+                if new[block:block + self.blocksize] != old[block:block + self.blocksize]:
+                    indexes.append(block // self.blocksize)
+        return indexes
+
+    def _make_delta(self, new, indexes):
+        """Helper function: Returns a delta containing the blocks of new with the given indexes."""
+        blocks = [new[i * self.blocksize:(i + 1) * self.blocksize] for i in indexes]
+        header = self.DeltaHeader()
+        header.magic = self.DELTAMAGIC
+        header.blockSize = self.blocksize
+        header.length = len(new)
+        header.blockCount = len(indexes)
+        indexes = array.array("I", indexes)
+        if sys.byteorder == "little":
+            indexes.byteswap()
+        return header.pack() + indexes.tobytes() + b"".join(blocks)
+
+    def _apply_delta(self, data, delta):
+        """Helper function: Applies a delta to the bytearray data."""
+        header = self.DeltaHeader.from_buffer_copy(delta)
+        if header.magic != self.DELTAMAGIC:
+            raise Exception("This is not a valid delta (wrong magic).")
+        offset = sizeof(header)
+        indexes = array.array("I", delta[offset:offset + header.blockCount * 4])
+        if sys.byteorder == "little":
+            indexes.byteswap()
+        offset += header.blockCount * 4
+
+        del data[header.length:]
+        data.extend(b"\x00" * (header.length - len(data)))
+        for index in indexes:
+            start = index * header.blockSize
+            end = min(start + header.blockSize, header.length)
+            data[start:end] = delta[offset:offset + end - start]
+            offset += end - start
+
+    def append(self, savegame):
+        """Adds a new version of a savegame. Returns the version number."""
+        gameid, ngid = savegame.bkHeader.get_gameid(), savegame.bkHeader.NGid
+        if not os.path.isdir(self._get_path(gameid, ngid)):
+            os.makedirs(self._get_path(gameid, ngid))
+
+        index = self._get_index(gameid, ngid)
+        version = len(index["sizes"])
+        data = savegame.pack(encrypt=False)
+        head_path = self._get_path(gameid, ngid, "head")
+        if version and index["head"] == version - 1:
+            with open(head_path, "rb") as file:
+                previous = file.read()
+            patch = True
+        else:
+            # First version or an earlier append was interrupted, rebuild the head from the last keyframe
+            previous = self.get(gameid, ngid, version - 1) if version else b""
+            patch = False
+
+        changed = self._get_changed_blocks(previous, data)
+        if version % self.keyframe_interval == 0:
+            _write_atomic(self._get_path(gameid, ngid, "{0:08d}.base".format(version)), data)
+        else:
+            _write_atomic(self._get_path(gameid, ngid, "{0:08d}.delta".format(version)),
+                          self._make_delta(data, changed))
+
+        # Head is invalid until it's patched, so an interrupted append can't leave a wrong latest version
+        index["sizes"].append(len(data))
+        index["head"] = None
+        self._write_index(gameid, ngid, index)
+        if patch:
+            with open(head_path, "r+b") as file:
+                for block in changed:
+                    file.seek(block * self.blocksize)
+                    file.write(data[block * self.blocksize:(block + 1) * self.blocksize])
+                file.truncate(len(data))
+        else:
+            _write_atomic(head_path, data)
+        index["head"] = version
+        self._write_index(gameid, ngid, index)
+        return version
+
+    def get_versions(self, gameid, ngid):
+        """Returns the number of stored versions of a savegame."""
+        return len(self._get_index(gameid, ngid)["sizes"])
+
+    def get(self, gameid, ngid, version=-1):
+        """Returns a version of a savegame (decrypted). Defaults to the latest one."""
+        index = self._get_index(gameid, ngid)
+        versions = len(index["sizes"])
+        if version < 0:
+            version += versions
+        if not 0 <= version < versions:
+            raise LookupError("Version not found.")
+
+        if version == index["head"]:
+            with open(self._get_path(gameid, ngid, "head"), "rb") as file:
+                return file.read()
+
+        keyframe = version - (version % self.keyframe_interval)
+        with open(self._get_path(gameid, ngid, "{0:08d}.base".format(keyframe)), "rb") as file:
+            data = bytearray(file.read())
+        for i in range(keyframe + 1, version + 1):
+            with open(self._get_path(gameid, ngid, "{0:08d}.delta".format(i)), "rb") as file:
+                self._apply_delta(data, file.read())
+        return bytes(data)
+
+    def dump(self, gameid, ngid, version, filename):
+        """Dumps a version of a savegame encrypted to filename. Returns the filename."""
+        data = memoryview(self.get(gameid, ngid, version))
+        headersize = sizeof(Savegame.Header)
+        offset = headersize + sizeof(Savegame.BkHeader)
+        bkheader = Savegame.BkHeader.from_buffer_copy(data[headersize:offset])
+
+        with open(str(filename), "wb") as file:
+            file.write(Crypto.encrypt_data(SDKEY, SDIV, data[:headersize]))
+            file.write(data[headersize:offset])
+            for i in range(bkheader.filesCount):
+                fileheader = Savegame.File.from_buffer_copy(data[offset:offset + sizeof(Savegame.File)])
+                iv = bytes(data[offset + 0x050:offset + 0x050 + 16])  # IV is always at 0x050 in the file header
+                file.write(data[offset:offset + sizeof(Savegame.File)])
+                offset += sizeof(Savegame.File)
+                file.write(Crypto.encrypt_data(SDKEY, iv, data[offset:offset + fileheader.get_size()]))
+                offset += fileheader.get_size()
+            file.write(data[offset:])
+            return file.name
+
+    def get_savings(self):
+        """Returns a dict with the size of all versions ("raw"), the bytes used on disk ("stored") and the
+           saved percentage ("savings").
+        """
+        raw = 0
+        stored = 0
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            if not os.path.isdir(path):
+                continue
+            with open(os.path.join(path, "index.json"), "rb") as file:
+                raw += sum(json.loads(file.read().decode())["sizes"])
+            for filename in os.listdir(path):
+                stored += os.path.getsize(os.path.join(path, filename))
+
+        return {
+            "raw": raw,
+            "stored": stored,
+            "savings": round(100 - (stored / raw * 100), 2) if raw else 0
+        }
+
+    def __repr__(self):
+        return "Savegame History at {0}".format(self.directory)
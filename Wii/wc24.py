@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+import asyncio
+import ssl
+import time
+from urllib.parse import urlsplit
+
+from .formats import NWC24dl
+
+
+class WC24Fetcher:
+    """Checks if the URLs of WiiConnect24 entries still serve content. URLs of many NWC24dl files are deduplicated
+       and fetched with asyncio, with at most `concurrency` requests at once and keep-alive connections that are
+       reused for further requests to the same host. A URL is only fetched again after the shortest frequency of
+       its entries has passed.
+
+       Results are dicts with the HTTP status (None if the request failed), the latency in seconds, the size of
+       the body and an error message (None if the request succeeded).
+
+       Args:
+           concurrency (int): Maximum number of requests at once
+           per_host (int): Maximum number of requests at once to the same host
+           timeout (float): Timeout of a request in seconds
+    """
+
+    def __init__(self, concurrency=16, per_host=4, timeout=10):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.results = {}
+        self.last_fetched = {}
+        self.connections = 0
+        self._idle = {}
+        self._limit = None
+        self._host_limits = {}
+
+    @staticmethod
+    def get_targets(files):
+        """Returns a dict of URL -> shortest frequency in minutes of all used entries of many files.
+
+        Args:
+            files (list): NWC24dl objects or paths to nwc24dl.bin files
+        """
+        targets = {}
+        for file in files:
+            if not isinstance(file, NWC24dl):
+                file = NWC24dl(file)
+            for entry in file.find():
+                url = entry.get_url()
+                if url not in targets or entry.frequency < targets[url]:
+                    targets[url] = entry.frequency
+        return targets
+
+    def get_due(self, targets, now=None):
+        """Returns the URLs of targets (see get_targets) that weren't fetched within their frequency."""
+        if now is None:
+            now = time.time()
+        due = []
+        for url, frequency in sorted(targets.items()):
+            if url not in self.last_fetched or now - self.last_fetched[url] >= frequency * 60:
+                due.append(url)
+        return due
+
+    def check(self, files, now=None):
+        """Fetches all due URLs of many files and returns their results as a dict of URL -> result.
+
+        Args:
+            files (list): NWC24dl objects or paths to nwc24dl.bin files
+            now (float): Current time as UNIX timestamp, defaults to time.time()
+        """
+        if now is None:
+            now = time.time()
+        urls = self.get_due(self.get_targets(files), now)
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(self.fetch_all(urls))
+        finally:
+            loop.close()
+
+        for url in results:
+            self.last_fetched[url] = now
+        self.results.update(results)
+        return results
+
+    async def fetch_all(self, urls):
+        """Fetches urls concurrently and returns a dict of URL -> result. Connections are closed afterwards."""
+        self._limit = asyncio.Semaphore(self.concurrency)
+        self._host_limits = {}
+        try:
+            results = await asyncio.gather(*[self.fetch(url) for url in urls])
+        finally:
+            for connections in self._idle.values():
+                for reader, writer in connections:
+                    writer.close()
+            self._idle = {}
+        return dict(zip(urls, results))
+
+    async def fetch(self, url):
+        """Fetches url and returns its result. Has to be called from fetch_all()."""
+        parts = urlsplit(url)
+        if parts.scheme not in ["http", "https"] or not parts.hostname:
+            return {"status": None, "latency": 0, "size": 0, "error": "Unsupported URL."}
+
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        host_limit = self._host_limits.setdefault(key, asyncio.Semaphore(self.per_host))
+        async with self._limit:
+            async with host_limit:
+                start = time.monotonic()
+                try:
+                    status, size = await asyncio.wait_for(self._get(key, parts), self.timeout)
+                    error = None
+                except asyncio.TimeoutError:
+                    status, size, error = None, 0, "Timeout."
+                except (OSError, EOFError, ValueError) as e:
+                    status, size, error = None, 0, str(e) or type(e).__name__
+                return {"status": status, "latency": time.monotonic() - start, "size": size, "error": error}
+
+    async def _connect(self, key):
+        """Helper function: Returns an idle connection to key (scheme, host, port) or opens a new one.
+           Returns the reader, the writer and whether the connection was reused.
+        """
+        if self._idle.get(key):
+            reader, writer = self._idle[key].pop()
+            return reader, writer, True
+        ssl_context = ssl.create_default_context() if key[0] == "https" else None
+        reader, writer = await asyncio.open_connection(key[1], key[2], ssl=ssl_context)
+        self.connections += 1
+        return reader, writer, False
+
+    async def _get(self, key, parts):
+        """Helper function: Sends a GET request and reads the response. Returns the status and the body size."""
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        request = "GET {0} HTTP/1.1\r\nHost: {1}\r\nConnection: keep-alive\r\n\r\n".format(
+            path,
+            parts.netloc.rsplit("@", 1)[-1]
+        ).encode()
+
+        while True:
+            reader, writer, reused = await self._connect(key)
+            try:
+                writer.write(request)
+                await writer.drain()
+                status_line = await reader.readline()
+            except ConnectionError:
+                if not reused:
+                    writer.close()
+                    raise
+                status_line = b""
+            except BaseException:
+                writer.close()
+                raise
+            if status_line:
+                break
+            writer.close()  # Idle connection was closed by the server, try another one
+            if not reused:
+                raise ConnectionError("Connection closed without response.")
+
+        try:
+            version, status = status_line.split(None, 2)[:2]
+            status = int(status)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in [b"\r\n", b"\n", b""]:
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            keep_alive = version == b"HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            if status in [204, 304] or 100 <= status < 200:
+                size = 0
+            elif "chunked" in headers.get("transfer-encoding", "").lower():
+                size = 0
+                while True:
+                    length = int((await reader.readline()).split(b";")[0], 16)
+                    if length == 0:
+                        while (await reader.readline()) not in [b"\r\n", b"\n", b""]:
+                            pass
+                        break
+                    size += len(await reader.readexactly(length))
+                    await reader.readexactly(2)
+            elif "content-length" in headers:
+                size = len(await reader.readexactly(int(headers["content-length"])))
+            else:
+                size = len(await reader.read())
+                keep_alive = False
+        except BaseException:
+            writer.close()
+            raise
+
+        if keep_alive:
+            self._idle.setdefault(key, []).append((reader, writer))
+        else:
+            writer.close()
+        return status, size
+
+    def __repr__(self):
+        return "WC24 Fetcher ({0} URL{1} checked)".format(
+            len(self.results),
+            "" if len(self.results) == 1 else "s"
+        )
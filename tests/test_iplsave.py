@@ -87,3 +87,51 @@ class TestIplSave:
         with pytest.raises(ValueError):
             obj.move_channel(1, 0, 0, 0, 0, 0)
             obj.add_disc_channel(99, 99, 99)
+
+    def test_index(self):
+        obj = Wii.IplSave("tests/data/iplsave.bin")
+        assert obj.get_channel_index_by_id4("JAVP") == obj.get_channel_index_by_titleid("000100014A415650") == 15
+        obj.move_channel(3, 0, 1, 0, 0, 3)
+        assert obj.get_channel_index_by_id4("JAVP") == 36
+        obj.delete_channel(0, 0, 3)
+        with pytest.raises(LookupError):
+            obj.get_channel_by_titleid("000100014a415650")
+        assert obj.get_channel_index_by_titleid("0000000000000000") == 0
+
+        obj.channels[14].delete()  # Changed directly
+        with pytest.raises(LookupError):
+            obj.get_channel_by_id4("5NEA")
+
+        obj.channels[14].titleid = 0x0001000148415858  # Written directly to another slot
+        assert obj.get_channel_index_by_titleid("0001000148415858") == obj.get_channel_index_by_id4("HAXX") == 14
+
+    def test_batch(self):
+        obj = Wii.IplSave("tests/data/iplsave.bin")
+        original = obj.pack()
+        with pytest.raises(LookupError):
+            with obj.batch() as batch:
+                batch.add_disc_channel(0, 0, 3)
+                batch.delete_channel(3, 2, 3)  # Empty slot
+        assert obj.pack() == original
+
+        with obj.batch() as batch:
+            batch.add_disc_channel(0, 0, 3)
+            batch.move_channel(3, 2, 0, 1, 1, 2)
+        assert obj.get_disc_channel_index() == 36
+        assert obj.get_channel_index_by_id4("HAPP") == 29
+        assert obj.generate_md5() == bytes(obj.md5)
+
+    def test_compact(self):
+        obj = Wii.IplSave("tests/data/iplsave.bin")
+        obj.add_disc_channel(0, 0, 2)
+        obj.delete_channel(1, 0, 0)
+        order = [channel.get_titleid() for channel in obj.channels if channel.titleid]
+        assert obj.find_free_slots() == 0
+        assert obj.find_free_slots(count=3) == 16
+        assert obj.find_free_slots(count=9, strategy="best") == 25
+
+        obj.compact()
+        assert obj.get_disc_channel_index() == 24
+        assert [channel.get_titleid() for channel in obj.channels[:14]] == order
+        assert obj.get_occupancy() == (1 << 14) - 1 | 1 << 24
+        assert obj.get_channel_index_by_id4("JAVP") == 13
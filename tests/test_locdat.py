@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+from binascii import hexlify
+
 import pytest
 
 import Wii
@@ -61,6 +63,8 @@ class TestLocDat:
         obj.move_channel(0, 0, 0, 0, 0, 19)
         obj.add_channel_by_id4("HAXX", 1, 1, 15)
         obj.add_channel_by_titleid("54455354", 0, 2, 9)
+        assert obj.md5_outdated
+        assert obj.get_md5_hash() == "e4b1e0e756ef7cd7794fc74b29f372a0"
 
         obj.dump(tmpdir + "/loc.dat")
 
@@ -83,3 +87,90 @@ class TestLocDat:
         with pytest.raises(ValueError):
             obj.move_channel(1, 0, 0, 0, 0, 0)
             obj.add_channel_by_id4("HAXX", 99, 99, 99)
+
+    def test_index(self):
+        obj = Wii.LocDat("tests/data/loc.dat")
+        assert obj.get_channel_index_by_id4("MBMP") == obj.get_channel_index_by_titleid("4d424d50")
+        obj.add_channel_by_id4("HAXX", 1, 1, 15)
+        assert obj.get_channel_index_by_id4("haxx") == 185
+        obj.move_channel(1, 1, 15, 0, 0, 19)
+        assert obj.get_channel_index_by_titleid("48415858") == 228
+        obj.delete_channel(0, 0, 19)
+        with pytest.raises(LookupError):
+            obj.get_channel_by_id4("HAXX")
+
+        position = obj.get_channel_index_by_id4("MBMP")
+        obj.channels[position].delete()  # Changed directly
+        with pytest.raises(LookupError):
+            obj.get_channel_by_id4("MBMP")
+        free = [channel.is_used() for channel in obj.channels].index(False)
+        assert obj.get_channel_index_by_titleid("00000000") == free
+
+        obj.channels[free] = obj.channels[obj.get_channel_index_by_id4("FAGP")]  # Written directly to another slot
+        obj.channels[free].id4[3] = ord("X")
+        assert obj.get_channel_index_by_id4("FAGX") == free
+
+    def test_batch(self):
+        obj = Wii.LocDat("tests/data/loc.dat")
+        original = obj.pack(encrypt=False)
+        with obj.batch() as batch:
+            batch.move_channel(0, 0, 0, 0, 0, 19)
+            batch.add_channel_by_id4("HAXX", 1, 1, 15)
+            batch.add_channel_by_titleid("54455354", 0, 2, 9)
+            assert obj.pack(encrypt=False) == original  # Nothing applied yet
+        assert not obj.md5_outdated
+        assert obj.get_md5_hash() == "e4b1e0e756ef7cd7794fc74b29f372a0"
+
+        obj = Wii.LocDat("tests/data/loc.dat")
+        with pytest.raises(Exception):
+            with obj.batch() as batch:
+                batch.add_channel_by_id4("HAXX", 1, 1, 15)
+                batch.add_channel_by_id4("HAYY", 1, 1, 15)  # Destination is used by HAXX
+        assert obj.pack(encrypt=False) == original
+        with pytest.raises(LookupError):
+            obj.get_channel_by_id4("HAXX")
+
+        with pytest.raises(AttributeError):
+            obj.batch().update_md5()
+
+    def test_used_blocks(self):
+        obj = Wii.LocDat("tests/data/loc.dat")
+        used = obj.get_used_blocks()
+        assert used == sum(channel.is_used() for channel in obj.channels)
+        obj.add_channel_by_id4("HAXX", 1, 1, 15)
+        assert obj.get_used_blocks() == used + 1
+        obj.delete_channel(1, 1, 15)
+        assert obj.get_used_blocks() == used
+
+        obj.channels[obj.get_channel_index_by_id4("MBMP")].delete()  # Changed directly
+        assert obj.get_used_blocks() == used - 1
+        assert obj.get_free_blocks() == 240 - used + 1
+
+    def test_placement(self):
+        obj = Wii.LocDat("tests/data/loc.dat")
+        occupancy = obj.get_occupancy()
+        assert bin(occupancy).count("1") == obj.get_used_blocks()
+        assert [bool(occupancy >> slot & 1) for slot in range(240)] == [c.is_used() for c in obj.channels]
+
+        assert Wii.find_free_slots(0b1101001, 7) == 1
+        assert Wii.find_free_slots(0b1101001, 7, strategy="best") == 4
+        assert Wii.find_free_slots(0b1101001, 7, count=2) == 1
+        with pytest.raises(LookupError):
+            Wii.find_free_slots(0b1101001, 7, count=3)
+
+        free = obj.find_free_slots()
+        assert obj.place_channel_by_id4("HAXX") == free
+        assert obj.get_channel_index_by_id4("HAXX") == free
+        start = obj.place_channels(["HAYA", "HAYB", "HAYC"], strategy="best")
+        assert [obj.get_channel_index_by_id4(id4) for id4 in ["HAYA", "HAYB", "HAYC"]] == [start, start + 1, start + 2]
+        with pytest.raises(Exception):
+            obj.place_channels(["HAZZ", "HAXX"])
+
+        order = [channel.get_id4() for channel in obj.channels if channel.is_used()]
+        obj.compact()
+        assert [channel.get_id4() for channel in obj.channels[:len(order)]] == order
+        assert obj.get_occupancy() == (1 << len(order)) - 1
+        assert obj.get_channel_index_by_id4("HAXX") == order.index("HAXX")
+        assert obj.md5_outdated
+        assert obj.get_md5_hash() == hexlify(obj.generate_md5()).decode()
+        assert not obj.md5_outdated
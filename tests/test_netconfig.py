@@ -59,6 +59,13 @@ class TestNetConfig:
         assert obj.connections[2].get_key() == "585b5a5f23322737395368234e"
         assert obj.connections[2].get_mtu() == 0
 
+    def test_used_slots(self):
+        obj = Wii.NetConfig("tests/data/config.dat")
+        assert obj.get_used_slots() == sum(not slot.is_blank() for slot in obj.connections)
+        obj.connections[0].delete()
+        assert obj.get_used_slots() == sum(not slot.is_blank() for slot in obj.connections)
+        assert Wii.NetConfig().get_used_slots() == 0
+
     def test_file_modification(self, tmpdir):
         obj = Wii.NetConfig()
         connection = obj.connections[2]
@@ -99,6 +106,43 @@ class TestNetConfig:
         assert new_connection.get_proxy_username() == "Example Proxy User"
         assert new_connection.get_proxy_password() == "Example Proxy Password"
 
+    def test_provision(self, tmpdir):
+        tmpdir = str(tmpdir)
+        template = Wii.NetConfig("tests/data/config.dat")
+        rows = ({
+            "ssid": "Example SSID",
+            "key": ("m&oVl,nV\"YuOH", "WEP128"),
+            "ip": "192.168.0.{0}".format(i + 1),
+            "netmask": "255.255.255.0",
+            "proxy": ["192.168.255.255", 2006],
+            "mtu": 1000
+        } for i in range(20))
+        filenames = list(Wii.NetConfig.provision(template, rows, tmpdir + "/{index}-{ip}.dat", slot=1, workers=2,
+                                                 chunksize=3))
+        assert len(filenames) == 20
+        assert filenames[13].endswith("13-192.168.0.14.dat")
+        obj = Wii.NetConfig(filenames[13])
+        assert obj.connections[1].get_ip() == "192.168.0.14"
+        assert obj.connections[1].get_ssid() == "Example SSID"
+        assert obj.connections[1].uses_proxy()
+        assert not obj.connections[1].is_ip_dhcp()
+        assert obj.connections[0].get_ssid() == template.connections[0].get_ssid()
+
+        connection = template.connections[1]
+        connection.set_ssid("Example SSID")
+        connection.set_key("m&oVl,nV\"YuOH", encryption="WEP128")
+        connection.set_ip("192.168.0.14")
+        connection.set_netmask("255.255.255.0")
+        connection.set_proxy("192.168.255.255", 2006)
+        connection.set_mtu(1000)
+        with open(filenames[13], "rb") as file:
+            assert file.read() == template.pack()
+
+        with pytest.raises(ValueError):
+            list(Wii.NetConfig.provision(template, [{}, {"ip": "999.0.0.1"}], tmpdir + "/{index}.dat", workers=1))
+        with pytest.raises(ValueError):
+            list(Wii.NetConfig.provision(template, [{"flags": 0}], tmpdir + "/{index}.dat", workers=1))
+
     def test_exceptions(self):
         obj = Wii.NetConfig()
         connection = obj.connections[0]
@@ -1,4 +1,8 @@
 #!/usr/bin/env python3
+from datetime import timedelta
+
+import pytest
+
 import Wii
 
 
@@ -58,3 +62,89 @@ class TestNWC24dl:
         assert new_obj.entries[117].get_filename() == "example.bin"
         assert new_obj.entries[117].dlLeft == 2006
         assert new_obj.entries[117].frequency == 1337
+
+    def test_find(self):
+        obj = Wii.NWC24dl("tests/data/nwc24dl.bin")
+        assert obj.find(id4="rmcp", return_index=True) == [10, 19, 20, 116, 117, 119]
+        assert obj.find(titleid="00010004524d4350", type=2, return_index=True) == [10, 119]
+        assert obj.find(type=3, host="RIICONNECT24.net", return_index=True) == [114, 115]
+        assert obj.find(host="weather.wapp.wii.com")[1].get_url() == "http://weather.wapp.wii.com/2/078/short.bin"
+        assert len(obj.find()) == obj.get_used_entries()
+        assert obj.find(id4="ABCD") == []
+
+        obj.entries[10].set_url("http://example.com/test.bin")  # Changed directly
+        assert [entry.index for entry in obj.find(host="example.com")] == [10]
+        assert obj.find(id4="RMCP", host="mariokartwii.race.gs.nintendowifi.net", return_index=True) == [19]
+        obj.entries[19].type = 2  # Changed directly
+        assert obj.find(id4="RMCP", type=3, return_index=True) == [20, 116, 117]
+        assert 19 in obj.find(type=2, return_index=True)
+        obj.entries[0].id = obj.entries[20].id  # Changed directly to start matching
+        assert obj.find(id4="RMCP", return_index=True)[0] == 0
+
+        with pytest.raises(ValueError):
+            obj.find(titleid="524d4350")
+
+    def test_schedule(self):
+        obj = Wii.NWC24dl("tests/data/nwc24dl.bin")
+        start = obj.records[8].get_next_download()
+        end = start + timedelta(days=1)
+        schedule = list(obj.get_schedule(start, end))
+        assert schedule == sorted(schedule)
+        assert schedule[0] == (obj.records[8].nextDl, 8)
+        assert [minute for minute, index in schedule if index == 0] == [obj.records[0].nextDl]  # 1 download left
+
+        other = Wii.NWC24dl("tests/data/nwc24dl.bin")
+        other.records[11].nextDl = 0  # Projected from the last successful download
+        other.entries[11].dlTimestamp = obj.records[8].nextDl + 60 - other.entries[11].frequency
+        other.records[12].nextDl = 0  # Never downloaded
+        other.entries[12].dlTimestamp = 0
+        tasks = {task[-1]: task[0] for task in other.get_tasks(start)}
+        assert tasks[11] == obj.records[8].nextDl + 60
+        assert tasks[12] == obj.records[8].nextDl
+
+        events = list(Wii.NWC24dl.simulate([obj, "tests/data/nwc24dl.bin"], start, end))
+        assert events == sorted(events)
+        assert [(minute, index) for minute, number, index in events if number == 1] == schedule
+
+        histogram = Wii.NWC24dl.get_load_histogram([obj, "tests/data/nwc24dl.bin"], start, end)
+        assert len(histogram) == 1440
+        assert sum(histogram) == len(events)
+        assert histogram[0] == 2 * sum(1 for minute, index in schedule if minute == schedule[0][0])
+        assert Wii.NWC24dl.get_load_histogram([Wii.NWC24dl()], start, end) == [0] * 1440
+
+    def test_add_remove(self, tmpdir):
+        obj = Wii.NWC24dl("tests/data/nwc24dl.bin")
+        assert obj.find(id4="RMCP", return_index=True) == [10, 19, 20, 116, 117, 119]
+        index = obj.add_entry("0001000148414a50", "http://example.com/test.bin", filename="test.bin", frequency=60)
+        assert index == 14  # First free slot after the 8 reserved ones
+        assert obj.records[index].get_id4() == "HAJP"
+        assert obj.entries[index].index == index
+        assert obj.get_used_entries() == 22
+        assert obj.find(host="example.com", return_index=True) == [14]
+
+        assert obj.add_entry("00010004524d4350", "http://example.com/", type=2, reserved=True) == 2
+        assert obj.find(id4="RMCP", return_index=True) == [2, 10, 19, 20, 116, 117, 119]
+        obj.remove_entry(10)
+        assert obj.records[10].is_empty() and obj.entries[10].is_empty()
+        assert obj.find(id4="RMCP", type=3, return_index=True) == [19, 20, 116, 117]
+        assert obj.add_entry("00010004524d4350", "http://example.com/") == 10  # Reused from the free-list
+
+        obj.entries[15].type = 3  # Changed directly
+        assert obj.add_entry("0001000148414a50", "http://example.com/") == 18
+
+        with pytest.raises(LookupError):
+            obj.remove_entry(21)
+        with pytest.raises(LookupError):
+            while True:
+                obj.add_entry("0001000148414a50", "http://example.com/")
+        assert obj.get_free_entries() == sum(entry.is_empty() for entry in obj.entries[:8])  # Only reserved ones
+        assert obj.get_used_entries() == sum(not entry.is_empty() for entry in obj.entries)
+        used = obj.get_used_entries()
+        obj.entries[19].type = 255  # Changed directly
+        assert obj.get_used_entries() == used - 1
+
+        obj.dump(tmpdir + "/nwc24dl.bin")
+        new_obj = Wii.NWC24dl(tmpdir + "/nwc24dl.bin")
+        assert new_obj.find(host="example.com", return_index=True) == obj.find(host="example.com", return_index=True)
+        assert new_obj.entries[14].get_filename() == "test.bin"
+        assert new_obj.entries[14].frequency == 60
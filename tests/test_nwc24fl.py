@@ -30,3 +30,45 @@ class TestNWC24fl:
         assert obj.friendList[0].get_status() == "Unconfirmed"
         assert obj.friendList[1].get_status() == "Unconfirmed"
         assert obj.friendList[2].get_status() == "Unconfirmed"
+
+    def test_find(self):
+        obj = Wii.NWC24fl("tests/data/nwc24fl.bin")
+        assert obj.find(friend_code=7135382492659598, return_index=True) == [1]
+        assert obj.find(email="TEST@example.com")[0].get_name() == "Example"
+        assert obj.find(name="testID")[0].get_friend_code() == 4252889816926870
+        assert obj.find(name="testID", friend_code=7135382492659598) == []
+        assert obj.find(return_index=True) == [0, 1, 2]
+        assert obj.get_friends() == {7135382492659598: 1, 4252889816926870: 1}
+
+        obj.friendList[1].status = 2  # Changed directly
+        obj.friendList[2].type = 0
+        assert obj.get_friends() == {7135382492659598: 2}
+        assert obj.find(name="testID") == []
+
+        obj.friendList[2].type = 1
+        obj.friendList[2].friendCode[:8] = list((4538991236898816).to_bytes(8, "big"))  # Ends with 0x00
+        assert obj.friendList[2].get_friend_code() == 4538991236898816
+        assert obj.find(friend_code=obj.friendList[2].get_friend_code(), return_index=True) == [2]
+        obj.friendList[0].friendCode[0] = -1  # Invalid UTF-8 in the e-mail
+        assert obj.find(name="testID", return_index=True) == [2]
+
+    def test_friendship_graph(self):
+        def make_list(friends):
+            friend_list = Wii.NWC24fl()
+            for slot, (friend_code, status) in enumerate(friends):
+                friend_list.friendList[slot].type = 1
+                friend_list.friendList[slot].status = status
+                friend_list.friendList[slot].friendCode[:8] = list(friend_code.to_bytes(8, "big", signed=True))
+            return friend_list
+
+        graph = Wii.NWC24fl.get_friendship_graph({
+            1111: make_list([(2222, 2), (3333, 1)]),
+            2222: make_list([(1111, 2), (3333, 1)]),
+            3333: make_list([(2222, 1)]),
+            4252889816926870: "tests/data/nwc24fl.bin"
+        })
+        assert graph[1111] == {2222: 2, 3333: 1}
+        assert graph[4252889816926870] == {7135382492659598: 1, 4252889816926870: 1}
+        assert Wii.NWC24fl.get_mutual_friends(graph) == [(1111, 2222), (2222, 3333)]
+        assert Wii.NWC24fl.get_mutual_friends(graph, confirmed=True) == [(1111, 2222)]
+        assert Wii.NWC24fl.get_mutual_friends(graph, confirmed=False) == [(2222, 3333)]
@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import os
+
 import Wii
 
 
@@ -54,6 +56,7 @@ class TestNWC24msg:
         obj.set_engine_url(2, "https://example.com/receive")
         obj.set_engine_url(3, "https://example.com/delete")
         obj.set_engine_url(4, "https://example.com/send")
+        assert obj.checksum == obj.generate_checksum() == 381436838
         obj.dump(tmpdir + "/nwc24msg.cfg")
 
         new_obj = Wii.NWC24msg(tmpdir + "/nwc24msg.cfg")
@@ -68,3 +71,22 @@ class TestNWC24msg:
             "https://example.com/send"
         ]
         assert new_obj.generate_checksum() == 381436838
+
+    def test_checksum(self, monkeypatch, tmpdir):
+        data = os.urandom(1027)
+        expected = [sum(int.from_bytes(data[i:min(i + 4, length)], "big") for i in range(0, length, 4)) & 0xFFFFFFFF
+                    for length in range(1024, 1028)]
+        for numpy in [Wii.common.numpy, None]:
+            monkeypatch.setattr(Wii.common, "numpy", numpy)
+            assert [Wii.Crypto.generate_checksum(data[:length]) for length in range(1024, 1028)] == expected
+            assert Wii.Crypto.generate_checksums([data[:length] for length in range(1024, 1028)]) == expected
+            assert Wii.Crypto.generate_checksums([data[:1024]] * 3) == [expected[0]] * 3
+
+        obj = Wii.NWC24msg("tests/data/nwc24msg.cfg")
+        obj.set_password("WiiPy3Password")
+        obj.dump(tmpdir + "/nwc24msg.cfg")
+        files = []
+        for filename in ["tests/data/nwc24msg.cfg", tmpdir + "/nwc24msg.cfg"]:
+            with open(str(filename), "rb") as file:
+                files.append(file.read())
+        assert Wii.Crypto.generate_checksums(files, end=-4) == [3307623949, obj.checksum]
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import os
 from binascii import hexlify
+from io import BytesIO
+
+import pytest
 
 import Wii
 
@@ -44,7 +47,10 @@ class TestSavegame:
         obj.erase_mac_address()
         obj.bkHeader.set_gameid("ZMGP")
         obj.header.set_title("SUPER LUIGI GALAXY")
+        assert obj.header.main.get_md5_hash() == hexlify(obj.header.generate_md5()).decode()
         obj.header.set_subtitle("Launch into a Luigi adventure!")
+        assert obj.header.main.get_md5_hash() == hexlify(obj.header.generate_md5()).decode()
+        assert not obj.header.md5_outdated
         obj.dump(tmpdir + "/data.bin")
 
         new_obj = Wii.Savegame(tmpdir + "/data.bin")
@@ -54,8 +60,263 @@ class TestSavegame:
         assert obj.header.banner.get_game_subtitle() == "Launch into a Luigi adventure!"
         assert new_obj.bkHeader.get_gameid() == "ZMGP"
 
+    def test_deferred_md5(self):
+        obj = Wii.Savegame("tests/data/data.bin")
+        md5 = obj.header.main.get_md5_hash()
+        obj.header.set_title("SUPER LUIGI GALAXY", update_md5=False)
+        obj.header.set_subtitle("Launch into a Luigi adventure!", update_md5=False)
+        assert obj.header.md5_outdated
+        assert obj.header.main.get_md5_hash() == md5
+        obj.header.flush()
+        assert not obj.header.md5_outdated
+        assert obj.header.main.get_md5_hash() == hexlify(obj.header.generate_md5()).decode() != md5
+
     def test_dumping(self, tmpdir):
         tmpdir = str(tmpdir)
         obj = Wii.Savegame("tests/data/data.bin")
         obj.extract_files(tmpdir + "/savegame_extracted")
         assert os.path.getsize(tmpdir + "/savegame_extracted/" + obj.files[0].get_name()) == obj.files[0].get_size()
+
+    def test_file_index(self, tmpdir):
+        tmpdir = str(tmpdir)
+        obj = Wii.Savegame("tests/data/data.bin")
+        index = Wii.Savegame.FileIndex("tests/data/data.bin")
+        assert len(index) == 1
+        assert index["GameData.bin"].iv == obj.files[0].iv
+        assert index["GameData.bin"].offset == 0xF0C0 + 0x80 + 0x80
+        assert index["GameData.bin"].get_size() == obj.files[0].get_size()
+
+        assert index.extract("GameData.bin", tmpdir + "/GameData.bin") == obj.files[0].header.size
+        with open(tmpdir + "/GameData.bin", "rb") as file:
+            assert file.read() == obj.files[0].data[:obj.files[0].header.size]
+
+        buffer = BytesIO()
+        index.extract("GameData.bin", buffer)
+        assert buffer.getvalue() == obj.files[0].data[:obj.files[0].header.size]
+
+        with pytest.raises(LookupError):
+            index.extract("Nothing.bin", buffer)
+
+    def test_workers(self):
+        obj = Wii.Savegame("tests/data/data.bin")
+        threaded_obj = Wii.Savegame("tests/data/data.bin", workers=4)
+        assert threaded_obj.files[0].data == obj.files[0].data
+        assert threaded_obj.pack() == obj.pack()
+
+        objs = Wii.Savegame.load_many(["tests/data/data.bin"] * 4, workers=2)
+        assert len(objs) == 4
+        for new_obj in objs:
+            assert new_obj.files[0].data == obj.files[0].data
+
+    def test_builder(self, tmpdir):
+        tmpdir = str(tmpdir)
+        obj = Wii.Savegame("tests/data/data.bin")
+        obj.extract_files(tmpdir + "/savegame_extracted")
+        os.mkdir(tmpdir + "/savegame_extracted/folder")
+        with open(tmpdir + "/savegame_extracted/folder/new.bin", "wb") as file:
+            file.write(b"Wii.py3")
+
+        builder = Wii.Savegame.Builder(obj.header, obj.bkHeader, tmpdir + "/savegame_extracted")
+        assert [file[0] for file in builder.files] == ["folder", "GameData.bin", "folder/new.bin"]
+        builder.dump(tmpdir + "/data.bin")
+
+        new_obj = Wii.Savegame(tmpdir + "/data.bin")
+        assert new_obj.header.main.get_md5_hash() == hexlify(new_obj.header.generate_md5()).decode()
+        assert new_obj.bkHeader.filesCount == 3
+        assert new_obj.bkHeader.filesSize == 3 * 0x80 + obj.files[0].get_size() + 64
+        assert new_obj.bkHeader.totalSize == new_obj.bkHeader.filesSize + 0x80  # Unsigned
+        assert new_obj.certificates == b""
+        assert not new_obj.files[0].is_file()
+        assert new_obj.files[1].get_name() == "GameData.bin"
+        assert new_obj.files[1].data == obj.files[0].data
+        assert new_obj.files[1].iv != obj.files[0].iv
+        assert new_obj.files[2].header.size == 7
+        assert new_obj.files[2].data[:7] == b"Wii.py3"
+
+        builder.add_file("GameData.bin", tmpdir + "/savegame_extracted/folder/new.bin")
+        builder.remove_file("folder/new.bin")
+        builder.dump(tmpdir + "/data2.bin")
+        new_obj = Wii.Savegame(tmpdir + "/data2.bin")
+        assert new_obj.bkHeader.filesCount == 2
+        assert new_obj.files[1].data[:7] == b"Wii.py3"
+
+        ng_private_key = Wii.ECC.generate_private_key()
+        ng_certificate = obj.get_ng_certificate()
+        ng_certificate.publicKey = Wii.ARRAY(Wii.c_byte, 60).from_buffer_copy(Wii.ECC.get_public_key(ng_private_key))
+        with pytest.raises(ValueError):
+            builder.dump(tmpdir + "/data3.bin", ng_private_key)
+        builder.dump(tmpdir + "/data3.bin", ng_private_key, ng_certificate)
+        new_obj = Wii.Savegame(tmpdir + "/data3.bin")
+        assert os.path.getsize(tmpdir + "/data3.bin") == Wii.sizeof(Wii.Savegame.Header) + new_obj.bkHeader.totalSize
+        assert new_obj.verify()
+        assert Wii.Savegame.verify_file(tmpdir + "/data3.bin")
+
+        with pytest.raises(ValueError):
+            builder.add_folder("x" * 0x45)
+
+    def test_diff(self, tmpdir):
+        tmpdir = str(tmpdir)
+        diff = Wii.Savegame.diff("tests/data/data.bin", "tests/data/data.bin")
+        assert diff.is_equal()
+
+        obj = Wii.Savegame("tests/data/data.bin")
+        data = bytearray(obj.files[0].data)
+        data[100:104] = b"\xFF\xFF\xFF\xFF"
+        data[20000] ^= 0x01
+        obj.files[0].data = bytes(data)
+        obj.header.set_title("SUPER LUIGI GALAXY")
+        obj.dump(tmpdir + "/data.bin")
+
+        diff = Wii.Savegame.diff("tests/data/data.bin", tmpdir + "/data.bin")
+        assert not diff.is_equal()
+        assert diff.get_changed_files() == ["GameData.bin"]
+        assert diff.files["GameData.bin"] == Wii.Savegame._diff_bytes(Wii.Savegame("tests/data/data.bin").files[0].data,
+                                                                     obj.files[0].data)
+        assert diff.files["GameData.bin"][-1] == (20000, 20001)
+        assert diff.bkHeader == []
+        assert diff.header[0] == (14, 30)  # MD5
+        assert diff.fileHeaders["GameData.bin"] == []
+
+        # Different IVs need a full decryption, but give the same result
+        builder = Wii.Savegame.Builder(obj.header, obj.bkHeader)
+        obj.extract_files(tmpdir + "/extracted")
+        builder.add_file("GameData.bin", tmpdir + "/extracted/GameData.bin")
+        builder.add_folder("folder")
+        builder.dump(tmpdir + "/data2.bin")
+        diff = Wii.Savegame.diff(tmpdir + "/data.bin", tmpdir + "/data2.bin")
+        assert diff.files["GameData.bin"] == []
+        assert diff.added == ["folder"]
+        assert Wii.Savegame.diff(tmpdir + "/data2.bin", tmpdir + "/data.bin").removed == ["folder"]
+
+    def test_banner_images(self, monkeypatch):
+        obj = Wii.Savegame("tests/data/data.bin")
+        banner = obj.header.banner.get_banner_rgba()
+        icon = obj.header.banner.get_icon_rgba(0)
+        assert len(banner) == 192 * 64 * 4
+        assert len(icon) == 48 * 48 * 4
+        assert banner[:4] == b"\x00\x10\x52\xff"
+        assert Wii.RGB5A3.encode(banner, 192, 64) == bytes(obj.header.banner.banner)
+
+        # Pure Python fallback must give the same results
+        monkeypatch.setattr(Wii.common, "numpy", None)
+        assert obj.header.banner.get_banner_rgba() == banner
+        assert obj.header.banner.get_icon_rgba(0) == icon
+        assert Wii.RGB5A3.encode(banner, 192, 64) == bytes(obj.header.banner.banner)
+
+        obj.header.banner.set_icon_rgba(1, b"\x08\x10\x18\xff" * 48 * 48)
+        assert obj.header.banner.get_icon_rgba(1) == b"\x08\x10\x18\xff" * 48 * 48
+        obj.header.banner.set_banner_rgba(b"\x00" * 192 * 64 * 4)
+        assert bytes(obj.header.banner.banner) == b"\x00" * 192 * 64 * 2
+
+        with pytest.raises(ValueError):
+            obj.header.banner.get_icon_rgba(8)
+        with pytest.raises(ValueError):
+            Wii.RGB5A3.encode(b"\x00" * 4, 2, 2)
+
+    def test_signature(self, tmpdir):
+        tmpdir = str(tmpdir)
+        obj = Wii.Savegame("tests/data/data.bin")
+        assert obj.get_ng_certificate().get_name() == "NG056a4d66"
+        assert obj.get_ap_certificate().get_issuer() == "Root-CA00000001-MS00000002-NG056a4d66"
+        assert obj.verify()
+        assert Wii.Savegame.verify_file("tests/data/data.bin")
+        assert Wii.Savegame.verify_many(["tests/data/data.bin", "tests/data/data.bin"]) == [True, True]
+
+        obj.bkHeader.set_gameid("ZMGP")
+        assert not obj.verify()
+
+        # Re-sign with our own console key
+        ng_private_key = Wii.ECC.generate_private_key()
+        ng_certificate = obj.get_ng_certificate()
+        ng_certificate.publicKey = Wii.ARRAY(Wii.c_byte, 60).from_buffer_copy(Wii.ECC.get_public_key(ng_private_key))
+        with pytest.raises(ValueError):
+            obj.resign(ng_private_key)
+        obj.resign(ng_private_key, ng_certificate)
+        assert obj.verify()
+        obj.dump(tmpdir + "/data.bin")
+        assert Wii.Savegame.verify_many(["tests/data/data.bin", tmpdir + "/data.bin"]) == [True, True]
+
+    def test_ecc(self):
+        private_key = Wii.ECC.generate_private_key()
+        public_key = Wii.ECC.get_public_key(private_key)
+        sha1hash = Wii.ECC.sha1(b"Wii.py3")
+        signature = Wii.ECC.sign(private_key, sha1hash)
+        assert Wii.ECC.verify(public_key, sha1hash, signature)
+        assert Wii.ECC.verify(public_key, sha1hash, signature, cache=False)
+        assert not Wii.ECC.verify(public_key, Wii.ECC.sha1(b"Wii.py"), signature)
+        assert Wii.ECC.point_mul(Wii.ECC.N - 1, Wii.ECC.G, cache=False) == (Wii.ECC.G[0], Wii.ECC.G[0] ^ Wii.ECC.G[1])
+
+    def test_ecc_cache(self, monkeypatch):
+        monkeypatch.setattr(Wii.ECC, "CACHESIZE", 2)
+        monkeypatch.setattr(Wii.ECC, "_tables", Wii.common.OrderedDict())
+        generator_table = Wii.ECC._get_table(Wii.ECC.G)
+        points = [Wii.ECC.point_mul(k, Wii.ECC.G) for k in [2, 3, 4]]
+        Wii.ECC.point_mul(5, points[0])
+        Wii.ECC.point_mul(5, points[1])
+        Wii.ECC.point_mul(5, points[0])  # Now most recently used
+        Wii.ECC.point_mul(5, points[2])
+        assert list(Wii.ECC._tables) == [points[0], points[2]]
+        assert Wii.ECC._get_table(Wii.ECC.G) is generator_table
+
+        Wii.ECC._tables.clear()
+        assert Wii.Savegame("tests/data/data.bin").verify()
+        assert len(Wii.ECC._tables) == 1  # Only the NG key, not the AP key of the savegame
+
+    def test_max_memory(self, tmpdir):
+        tmpdir = str(tmpdir)
+        obj = Wii.Savegame("tests/data/data.bin")
+        spilled_obj = Wii.Savegame("tests/data/data.bin", max_memory=0)
+        assert isinstance(spilled_obj.files[0].data, memoryview)
+        assert spilled_obj.files[0].data == obj.files[0].data
+        assert isinstance(Wii.Savegame("tests/data/data.bin", max_memory=1 << 20).files[0].data, bytearray)
+
+        spilled_obj.dump(tmpdir + "/data.bin")
+        with open("tests/data/data.bin", "rb") as original, open(tmpdir + "/data.bin", "rb") as dumped:
+            assert original.read() == dumped.read()
+
+        spilled_obj.files[0].data[0:4] = b"Wii!"
+        spilled_obj.dump(tmpdir + "/data.bin")
+        assert Wii.Savegame(tmpdir + "/data.bin").files[0].data[0:4] == b"Wii!"
+
+    def test_crypto_buffers(self):
+        data = os.urandom(100)
+        encrypted = Wii.Crypto.encrypt_data(Wii.SDKEY, Wii.SDIV, data)
+        assert len(encrypted) == 128
+
+        buffer = bytearray(128)
+        assert Wii.Crypto.encrypt_data(Wii.SDKEY, Wii.SDIV, data, output=buffer) is buffer
+        assert buffer == encrypted
+        Wii.Crypto.decrypt_data(Wii.SDKEY, Wii.SDIV, buffer, output=buffer)
+        assert buffer == data + b"\x00" * 28
+
+        cipher = Wii.Crypto.CBC(Wii.SDKEY, Wii.SDIV)
+        view = memoryview(bytearray(encrypted))
+        for start in range(0, 128, 32):
+            cipher.decrypt(view[start:start + 32], output=view[start:start + 32])
+        assert view[:100] == data
+
+        with pytest.raises(ValueError):
+            Wii.Crypto.encrypt_data(Wii.SDKEY, Wii.SDIV, data, output=bytearray(64))
+        with pytest.raises(ValueError):
+            Wii.Crypto.encrypt_data(Wii.SDKEY, Wii.SDIV, data, align=False)
+
+    def test_crypto_backends(self, monkeypatch):
+        monkeypatch.setattr(Wii.Crypto, "_selected", {})
+        obj = Wii.Savegame("tests/data/data.bin")
+        assert Wii.Crypto.get_backend("aes").NATIVE
+
+        for name, backend in Wii.Crypto.BACKENDS.items():
+            if not backend.is_available() or not backend.supports("aes"):
+                continue
+            Wii.Crypto.set_backend(name, ["aes"])
+            assert Wii.Crypto.get_backend("aes") is backend
+            assert Wii.Savegame("tests/data/data.bin").files[0].data == obj.files[0].data
+            with open("tests/data/data.bin", "rb") as file:
+                assert obj.pack() == file.read()
+
+        Wii.Crypto.set_backend("hashlib")
+        assert Wii.Crypto.create_md5hash(b"") == b"\xd4\x1d\x8c\xd9\x8f\x00\xb2\x04\xe9\x80\t\x98\xec\xf8B~"
+        with pytest.raises(ValueError):
+            Wii.Crypto.set_backend("hashlib", ["aes"])
+        with pytest.raises(ValueError):
+            Wii.Crypto.set_backend("openssl")
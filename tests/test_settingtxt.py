@@ -64,6 +64,39 @@ class TestSettingTXT:
         self._test_file_modification(Wii.SettingTXT(tmpdir + "/setting.txt"))
         self._test_file_modification(Wii.SettingTXT(tmpdir + "/setting_unencrypted.txt", encrypted=False))
 
+    def test_crypt_many(self, monkeypatch):
+        with open("tests/data/setting.txt", "rb") as file:
+            encrypted = file.read()
+        decrypted = Wii.SettingTXT.crypt(encrypted)
+        assert decrypted.startswith(b"AREA=EUR\r\nMODEL=RVL-001(EUR)\r\n")
+
+        for numpy in [Wii.formats.numpy, None]:
+            monkeypatch.setattr(Wii.formats, "numpy", numpy)
+            assert Wii.SettingTXT.crypt_many([encrypted] * 3) == [Wii.SettingTXT.crypt(encrypted)] * 3
+            assert Wii.SettingTXT.crypt_many([decrypted, encrypted[:16]]) == [encrypted, decrypted[:16]]
+
+    def test_provision(self, tmpdir):
+        tmpdir = str(tmpdir)
+        template = Wii.SettingTXT("tests/data/setting.txt")
+        rows = ({"SERNO": "1337{0:05d}".format(i), "code": "LEH"} for i in range(20))
+        filenames = list(Wii.SettingTXT.provision(template, rows, tmpdir + "/{index}-{SERNO}.txt", workers=2,
+                                                  chunksize=3))
+        assert len(filenames) == 20
+        obj = Wii.SettingTXT(filenames[13])
+        assert filenames[13].endswith("13-133700013.txt")
+        assert obj.get_serial() == "133700013"
+        assert obj.get_code() == "LEH"
+        assert obj.get_area() == "EUR"
+
+        template.set_serial("133700013")
+        template.set_code("LEH")
+        with open(filenames[13], "rb") as file:
+            assert file.read() == template.pack()
+        assert template.length == len(template.pack(encrypt=False))
+
+        with pytest.raises(ValueError):
+            list(Wii.SettingTXT.provision(template, [{}, {"SERNO": "1" * 200}], tmpdir + "/{index}.txt", workers=1))
+
     def test_exceptions(self):
         obj = Wii.SettingTXT()
         with pytest.raises(KeyError):
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import os
+
+import pytest
+
+import Wii
+
+
+class TestSavegameStore:
+    def test_ingest_and_rebuild(self, tmpdir):
+        tmpdir = str(tmpdir)
+        store = Wii.SavegameStore(tmpdir + "/store")
+        obj = Wii.Savegame("tests/data/data.bin")
+        manifest_id = store.ingest(obj)
+        assert store.get_manifests() == [manifest_id]
+        assert store.has_object(store.get_manifest(manifest_id)["files"][0]["data"])
+
+        store.rebuild(manifest_id, tmpdir + "/data.bin")
+        with open("tests/data/data.bin", "rb") as original, open(tmpdir + "/data.bin", "rb") as rebuilt:
+            assert original.read() == rebuilt.read()
+
+    def test_deduplication(self, tmpdir):
+        tmpdir = str(tmpdir)
+        store = Wii.SavegameStore(tmpdir + "/store")
+        obj = Wii.Savegame("tests/data/data.bin")
+        manifest_id = store.ingest(obj)
+        size = store.get_size()
+        assert store.ingest(obj) == manifest_id
+        assert store.get_size() == size
+
+        # Same payload from another console only adds a new manifest
+        obj.erase_mac_address()
+        new_manifest_id = store.ingest(obj)
+        assert new_manifest_id != manifest_id
+        assert len(store.get_manifests()) == 2
+        assert store.get_size() - size < 2048
+
+        store.rebuild(new_manifest_id, tmpdir + "/data.bin")
+        assert Wii.Savegame(tmpdir + "/data.bin").bkHeader.get_mac_address() == "00:00:00:00:00:00"
+
+    def test_exception(self, tmpdir):
+        store = Wii.SavegameStore(str(tmpdir))
+        with pytest.raises(LookupError):
+            store.get_manifest("0" * 64)
+        with pytest.raises(LookupError):
+            store.get_object("0" * 64)
+
+
+class TestSavegameHistory:
+    def test_history(self, tmpdir):
+        tmpdir = str(tmpdir)
+        history = Wii.SavegameHistory(tmpdir + "/history", keyframe_interval=3)
+        obj = Wii.Savegame("tests/data/data.bin")
+
+        versions = []
+        for i in range(5):
+            data = bytearray(obj.files[0].data)
+            data[i * 5000] = 0xFF - data[i * 5000]
+            obj.files[0].data = bytes(data)
+            assert history.append(obj) == i
+            versions.append(obj.pack(encrypt=False))
+
+        assert history.get_versions("RMGP", 90852710) == 5
+        for i in range(5):
+            assert history.get("RMGP", 90852710, i) == versions[i]
+        assert history.get("RMGP", 90852710) == versions[-1]
+
+        history.dump("RMGP", 90852710, 2, tmpdir + "/data.bin")
+        assert Wii.Savegame(tmpdir + "/data.bin").pack(encrypt=False) == versions[2]
+
+        savings = history.get_savings()
+        assert savings["raw"] == 5 * len(versions[0])
+        assert savings["stored"] < 4 * len(versions[0])
+        assert savings["savings"] > 20
+
+        with pytest.raises(LookupError):
+            history.get("RMGP", 90852710, 5)
+
+        # Head is patched in place and rebuilt from the last keyframe after an interrupted append
+        head = os.path.join(tmpdir, "history", "RMGP-056a4d66", "head")
+        with open(head, "r+b") as file:
+            file.write(b"\x00" * 16)
+        history._write_index("RMGP", 90852710, {"sizes": [len(version) for version in versions], "head": None})
+        assert history.get("RMGP", 90852710) == versions[-1]
+        obj.files[0].data = obj.files[0].data[:-1] + b"\x01"
+        assert history.append(obj) == 5
+        assert history.get("RMGP", 90852710) == obj.pack(encrypt=False)
+        with open(head, "rb") as file:
+            assert file.read() == obj.pack(encrypt=False)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import Wii
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 5), reason="Requires async/await")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if self.path.startswith("/missing"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path.startswith("/chunked"):
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self.wfile.write(b"4\r\nWC24\r\n3\r\n.py\r\n0\r\n\r\n")
+        else:
+            self.send_response(200)
+            self.send_header("Content-Length", "512")
+            self.end_headers()
+            self.wfile.write(b"\x00" * 512)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.requests = []
+    httpd = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield "http://127.0.0.1:{0}".format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+class TestWC24Fetcher:
+    def test_check(self, server):
+        obj = Wii.NWC24dl()
+        obj.add_entry("0001000148414a50", server + "/voting.bin", frequency=60)
+        obj.add_entry("0001000148414a50", server + "/missing.bin", frequency=60)
+        obj.add_entry("0001000248414650", server + "/chunked", frequency=30)
+        other = Wii.NWC24dl()
+        other.add_entry("0001000148414a50", server + "/voting.bin", frequency=30)
+        other.add_entry("0001000148414a50", "http://127.0.0.1:1/refused.bin")
+
+        fetcher = Wii.WC24Fetcher(concurrency=2, per_host=1)
+        assert fetcher.get_targets([obj, other])[server + "/voting.bin"] == 30
+        results = fetcher.check([obj, other], now=0)
+        assert len(results) == 4
+        assert sorted(Handler.requests) == ["/chunked", "/missing.bin", "/voting.bin"]  # Deduplicated
+        assert fetcher.connections == 1  # Reused for all requests to the server
+        assert results[server + "/voting.bin"]["status"] == 200
+        assert results[server + "/voting.bin"]["size"] == 512
+        assert results[server + "/voting.bin"]["latency"] > 0
+        assert results[server + "/missing.bin"]["status"] == 404
+        assert results[server + "/chunked"]["size"] == 7
+        assert results["http://127.0.0.1:1/refused.bin"]["status"] is None
+        assert results["http://127.0.0.1:1/refused.bin"]["error"]
+
+        assert fetcher.check([obj, other], now=60) == {}
+        assert sorted(fetcher.check([obj, other], now=30 * 60)) == [server + "/chunked", server + "/voting.bin"]
+        assert len(fetcher.results) == 4